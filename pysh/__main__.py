@@ -7,7 +7,7 @@ See README for usage of the pysh CLI
 import subprocess
 import sys
 
-from pysh.interface import hook
+from pysh.interface import client
 
 
 def main():
@@ -15,8 +15,19 @@ def main():
     run pysh command or interactive mode
     """
     if len(sys.argv) < 2:
+        from pysh.interface import hook
         subprocess.Popen(["python3", "-i", hook.__file__]).wait()
+    elif sys.argv[1] == "--serve":
+        from pysh.interface import server
+        server.serve()
+    elif sys.argv[1] == "--profile":
+        from pysh.interface import hook
+        hook.patch_and_run(*sys.argv[2:], profile=True)
     else:
+        exit_code = client.request(sys.argv[1:])
+        if exit_code is not None:
+            sys.exit(exit_code)
+        from pysh.interface import hook
         hook.patch_and_run(*sys.argv[1:])
 
 
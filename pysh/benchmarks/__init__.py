@@ -0,0 +1,5 @@
+"""
+Benchmarks of pysh pipelines against equivalent bash pipelines
+
+    python -m pysh.benchmarks [--quick] [--output PATH] [--compare PATH]
+"""
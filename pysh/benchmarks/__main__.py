@@ -0,0 +1,51 @@
+"""
+run the pysh benchmark suite
+
+Writes the results as json and exits nonzero if any benchmark got slower
+since the results it is compared against (by default the last ones
+stored)
+"""
+
+import argparse
+import json
+import sys
+
+from pysh.benchmarks import suite
+
+
+def main():
+    """
+    run the benchmarks, store their results and compare them
+    """
+    parser = argparse.ArgumentParser(prog="python -m pysh.benchmarks")
+    parser.add_argument("--quick", action="store_true",
+                        help="run on a small input, once each")
+    parser.add_argument("--output", help="the path to write results to")
+    parser.add_argument("--compare",
+                        help="the path of results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="the fraction by which a time may grow")
+    args = parser.parse_args()
+    previous_path = args.compare or suite.latest_results_path()
+    if args.quick:
+        benchmarks = suite.Suite(input_size=1024 * 1024, repeat=1)
+    else:
+        benchmarks = suite.Suite()
+    results = benchmarks.run()
+    for line in suite.format_results(results):
+        print(line)
+    print("results written to {}".format(
+        suite.write_results(results, args.output)))
+    if previous_path is None:
+        return 0
+    with open(previous_path) as previous_file:
+        previous = json.load(previous_file)
+    regressions = suite.compare(previous, results, args.tolerance)
+    for name, before, after in regressions:
+        sys.stderr.write("{}: {:.4f}s -> {:.4f}s\n".format(
+            name, before, after))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+"""
+the pysh benchmark suite
+
+Each benchmark times some work done by pysh and the same work done by a
+bash pipeline, keeping the best of a number of runs of each. Results are
+stored as json so that later runs can be compared against them.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from pysh.interface import cache, shell
+
+PIPELINE_DEPTHS = (1, 2, 4, 8)
+
+SCOPE_IMPORT_SCRIPT = """
+import importlib, sys, time
+from pysh.interface import hook, shell
+sys.meta_path.insert(0, hook.PyshImportHook())
+start = time.perf_counter()
+for module_name in shell.SEARCH_PATH.split(":"):
+    importlib.import_module(module_name)
+print(time.perf_counter() - start)
+"""
+
+
+def default_results_dir():
+    """
+    return the directory in which benchmark results are stored by default
+    """
+    return os.path.join(os.path.dirname(cache.default_cache_dir()),
+                        "benchmarks")
+
+
+def best_time(run, repeat):
+    """
+    return the shortest time in seconds taken by repeat calls of run
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_bash(script, **kwargs):
+    """
+    run a bash script, discarding its output
+    """
+    subprocess.run(["bash", "-c", script],
+                   stdout=subprocess.DEVNULL,
+                   check=True,
+                   **kwargs)
+
+
+def result(name, pysh_time, bash_time, **extra):
+    """
+    return the record of a benchmark's timings
+    """
+    return dict(
+        extra,
+        name=name,
+        pysh=pysh_time,
+        bash=bash_time,
+        ratio=pysh_time / bash_time if bash_time else None)
+
+
+def write_input(path, size):
+    """
+    write about size bytes of text lines to path, a tenth of which
+    contain the word "needle"
+    """
+    written = 0
+    with open(path, 'w') as input_file:
+        index = 0
+        while written < size:
+            word = "needle" if index % 10 == 0 else "hay"
+            line = "{} the quick brown fox jumps over {} lazy dogs\n".format(
+                index, word)
+            input_file.write(line)
+            written += len(line)
+            index += 1
+
+
+def pysh_env(runtime_dir):
+    """
+    return an environment in which a fresh interpreter can import pysh
+    and, looking for servers in an empty runtime_dir, won't hand commands
+    to a running pysh server
+    """
+    pkg_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+    python_path = [pkg_root] + [
+        path for path in os.environ.get("PYTHONPATH", "").split(os.pathsep)
+        if path
+    ]
+    return dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(python_path),
+        XDG_RUNTIME_DIR=runtime_dir)
+
+
+class Suite(object):
+    """
+    Runs the benchmarks over an input of input_size bytes, each repeat
+    times
+    """
+
+    def __init__(self, input_size=16 * 1024 * 1024, repeat=3,
+                 depths=PIPELINE_DEPTHS):
+        self.input_size = input_size
+        self.repeat = repeat
+        self.depths = depths
+        self.functions = shell.Shell(search_path="pysh.examples.posix")
+        self.processes = shell.Shell(search_path="")
+
+    def run(self):
+        """
+        run every benchmark, returning the results as a dict
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.txt")
+            write_input(input_path, self.input_size)
+            results = [self.grep_throughput(input_path)]
+            results.extend(
+                self.pipeline(input_path, depth) for depth in self.depths)
+        with tempfile.TemporaryDirectory() as runtime_dir:
+            env = pysh_env(runtime_dir)
+            results.append(self.startup(env))
+            results.append(self.scope_import(env))
+        return {
+            'time': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'input_size': self.input_size,
+            'repeat': self.repeat,
+            'results': results,
+        }
+
+    @staticmethod
+    def run_call(call, **channels):
+        """
+        run a pysh call, discarding its output
+        """
+        with open(os.devnull, 'w') as devnull:
+            exit_code = call(stdout=devnull, **channels)
+        if exit_code:
+            raise RuntimeError("Benchmarked call failed", exit_code)
+
+    def grep_throughput(self, input_path):
+        """
+        time posix.grep filtering a file against grep -F
+        """
+
+        def run_pysh():
+            """
+            grep the file with posix.grep
+            """
+            with open(input_path) as input_file:
+                self.run_call(
+                    self.functions.grep("needle"), stdin=input_file)
+
+        pysh_time = best_time(run_pysh, self.repeat)
+        bash_time = best_time(
+            lambda: run_bash("grep -F needle < {}".format(input_path)),
+            self.repeat)
+        megabytes = os.path.getsize(input_path) / (1024 * 1024)
+        return result(
+            "grep_throughput",
+            pysh_time,
+            bash_time,
+            pysh_mb_s=megabytes / pysh_time,
+            bash_mb_s=megabytes / bash_time)
+
+    def pipeline(self, input_path, depth):
+        """
+        time cat piped through depth greps, alternately posix.grep and the
+        grep executable, against the same pipeline in bash
+        """
+
+        def make_call():
+            """
+            return the pysh pipeline
+            """
+            call = self.processes.cat(input_path)
+            for index in range(depth):
+                grep = self.functions.grep if index % 2 == 0 else \
+                    self.processes.grep
+                call = call | grep("o")
+            return call
+
+        pysh_time = best_time(lambda: self.run_call(make_call()),
+                              self.repeat)
+        script = "cat {}{}".format(input_path, " | grep -F o" * depth)
+        bash_time = best_time(lambda: run_bash(script), self.repeat)
+        return result("pipeline_depth_{}".format(depth), pysh_time,
+                      bash_time, depth=depth)
+
+    def startup(self, env):
+        """
+        time `python -m pysh echo` against bash's echo, both from scratch
+        """
+
+        def run_pysh():
+            """
+            run echo with a fresh pysh
+            """
+            subprocess.run([sys.executable, "-m", "pysh", "echo", "hello"],
+                           stdout=subprocess.DEVNULL,
+                           env=env,
+                           check=True)
+
+        pysh_time = best_time(run_pysh, self.repeat)
+        bash_time = best_time(lambda: run_bash("echo hello"), self.repeat)
+        python_time = best_time(
+            lambda: subprocess.run([sys.executable, "-c", "pass"], check=True),
+            self.repeat)
+        return result("startup", pysh_time, bash_time, python=python_time)
+
+    def scope_import(self, env):
+        """
+        time importing the scopes on the search path in a fresh interpreter
+
+        bash has nothing like scopes so its baseline is sourcing an empty
+        script
+        """
+        times = []
+        for _ in range(self.repeat):
+            out = subprocess.run([sys.executable, "-c", SCOPE_IMPORT_SCRIPT],
+                                 stdout=subprocess.PIPE,
+                                 env=env,
+                                 check=True,
+                                 universal_newlines=True).stdout
+            times.append(float(out))
+        bash_time = best_time(lambda: run_bash("source /dev/null"),
+                              self.repeat)
+        return result("scope_import", min(times), bash_time)
+
+
+def write_results(results, path=None):
+    """
+    write results as json, by default to a file named after the time in
+    the default results directory, and return the path written
+    """
+    if path is None:
+        results_dir = default_results_dir()
+        os.makedirs(results_dir, exist_ok=True)
+        path = os.path.join(
+            results_dir,
+            time.strftime("%Y%m%dT%H%M%S.json",
+                          time.localtime(results['time'])))
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    return path
+
+
+def latest_results_path(results_dir=None):
+    """
+    return the path of the most recent stored results or None
+    """
+    results_dir = results_dir or default_results_dir()
+    try:
+        names = sorted(name for name in os.listdir(results_dir)
+                       if name.endswith(".json"))
+    except OSError:
+        return None
+    return os.path.join(results_dir, names[-1]) if names else None
+
+
+def compare(previous, current, tolerance=0.1):
+    """
+    return (name, previous time, current time) for each benchmark whose
+    pysh time grew by more than tolerance (a fraction) since previous
+
+    Results of runs over inputs of different sizes are not comparable
+    """
+    if previous.get('input_size') != current.get('input_size'):
+        return []
+    before = {record['name']: record for record in previous['results']}
+    regressions = []
+    for record in current['results']:
+        old = before.get(record['name'])
+        if old is None:
+            continue
+        if record['pysh'] > old['pysh'] * (1 + tolerance):
+            regressions.append((record['name'], old['pysh'], record['pysh']))
+    return regressions
+
+
+def format_results(results):
+    """
+    return the results as a table of lines
+    """
+    rows = [["benchmark", "pysh", "bash", "ratio"]]
+    for record in results['results']:
+        rows.append([
+            record['name'], "{:.4f}".format(record['pysh']),
+            "{:.4f}".format(record['bash']), "-" if record['ratio'] is None
+            else "{:.1f}x".format(record['ratio'])
+        ])
+    widths = [max(len(row[index]) for row in rows) for index in range(4)]
+    return [
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths))
+        .rstrip() for row in rows
+    ]
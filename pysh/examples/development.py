@@ -2,12 +2,21 @@
 Examples of pysh commands for common development workflows
 """
 
+import contextvars
+import functools
+import glob
+import json
 import os
+import re
+
+from concurrent import futures
 
 from nose.tools import nottest
 
-from pysh.interface.command import pyshcommand
+from pysh.interface.command import (FunctionCommand, getcwd, pyshcommand,
+                                    resolve_path)
 from pysh.interface.shell import Shell
+from pysh.interface.task import pyshtask
 
 SH = Shell(search_path='')
 
@@ -19,6 +28,155 @@ class TestFailure(Exception):
     pass
 
 
+def find_shards(pkg_paths):
+    """
+    split package paths into shards of paths which can be checked apart
+
+    A package's top-level modules make up one shard and each of its
+    subpackages another
+    """
+    shards = []
+    for pkg_path in pkg_paths:
+        if not os.path.isdir(pkg_path):
+            shards.append((pkg_path, ))
+            continue
+        entry_paths = [
+            os.path.join(pkg_path, entry)
+            for entry in sorted(os.listdir(pkg_path))
+        ]
+        modules = tuple(path for path in entry_paths if path.endswith(".py"))
+        if modules:
+            shards.append(modules)
+        shards.extend((path, ) for path in entry_paths
+                      if os.path.isfile(os.path.join(path, '__init__.py')))
+    return shards
+
+
+def check_shards(args, shards):
+    """
+    run python3 with args followed by each shard's paths, in parallel
+
+    returns (exit_code, stdout, stderr) for each shard, in shard order
+    """
+    results = {
+        shard: (exit_code, out, err)
+        for shard, exit_code, out, err in SH.map(
+            functools.partial(SH.python3, *args), shards)
+    }
+    return [results[shard] for shard in shards]
+
+
+def find_modules(pkg_paths):
+    """
+    return the paths of every python module under the package paths
+    """
+    paths = []
+    for pkg_path in pkg_paths:
+        if not os.path.isdir(pkg_path):
+            paths.append(pkg_path)
+            continue
+        for dir_path, dir_names, file_names in os.walk(pkg_path):
+            dir_names.sort()
+            paths.extend(
+                os.path.join(dir_path, file_name)
+                for file_name in sorted(file_names)
+                if file_name.endswith(".py"))
+    return paths
+
+
+def file_keys(paths, changed_by):
+    """
+    return a dict of each path to a key which changes with the file
+
+    changed_by is 'git' to key files on their git object hash or 'mtime'
+    to key them on their modification time and size
+    """
+    if changed_by == 'mtime':
+        stats = [os.stat(path) for path in paths]
+        return {
+            path: "{}:{}".format(stat.st_mtime_ns, stat.st_size)
+            for path, stat in zip(paths, stats)
+        }
+    if changed_by != 'git':
+        raise ValueError("Unknown way to find changed files", changed_by)
+    keys = {}
+    # keep well under the limit on the length of arguments
+    for start in range(0, len(paths), 512):
+        batch = paths[start:start + 512]
+        out, err = SH.git('hash-object', '--', *batch)
+        hashes = out.split()
+        if len(hashes) != len(batch):
+            raise TestFailure("Could not hash files with git", err)
+        keys.update(zip(batch, hashes))
+    return keys
+
+
+def check_changed(args, pkg_paths, results_path, changed_by):
+    """
+    run python3 with args followed by each module that changed since the
+    last check, reusing the stored results of the unchanged ones
+
+    returns (exit_code, stdout, stderr) for each module, in path order
+    """
+    try:
+        with open(results_path) as results_file:
+            stored = json.load(results_file)
+    except (OSError, ValueError):
+        stored = {}
+    if stored.get('args') != args or stored.get('changed_by') != changed_by:
+        stored = {'args': args, 'changed_by': changed_by, 'files': {}}
+    paths = find_modules(pkg_paths)
+    keys = file_keys(paths, changed_by)
+    files = {
+        path: stored['files'][path]
+        for path in paths
+        if stored['files'].get(path, {}).get('key') == keys[path]
+    }
+    changed = [(path, ) for path in paths if path not in files]
+    for (path, ), (exit_code, out, err) in zip(changed,
+                                              check_shards(args, changed)):
+        files[path] = {
+            'key': keys[path],
+            'exit_code': exit_code,
+            'out': out,
+            'err': err,
+        }
+    stored['files'] = files
+    with open(results_path, 'w') as results_file:
+        json.dump(stored, results_file)
+    return [(files[path]['exit_code'], files[path]['out'],
+             files[path]['err']) for path in paths]
+
+
+def check(tool, args, pkg_paths, proj_path):
+    """
+    run python3 with args over the package paths
+
+    If $PYSH_CHECK_CHANGED is 'git' or 'mtime' only the modules changed
+    since the last check are checked, one at a time. Otherwise every
+    module is checked in shards.
+    """
+    changed_by = os.environ.get("PYSH_CHECK_CHANGED")
+    if not changed_by:
+        return check_shards(args, find_shards(pkg_paths))
+    results_path = os.path.join(proj_path, ".{}_results.json".format(tool))
+    return check_changed(args, pkg_paths, results_path, changed_by)
+
+
+def merge_html(reports):
+    """
+    merge the bodies of html reports into a single report
+    """
+    if len(reports) == 1:
+        return reports[0]
+    bodies = []
+    for report in reports:
+        match = re.search(r"<body[^>]*>(.*)</body>", report,
+                          re.DOTALL | re.IGNORECASE)
+        bodies.append(match.group(1) if match else report)
+    return "<html><body>\n{}\n</body></html>\n".format("\n".join(bodies))
+
+
 def test_lint():
     """
     Lint the current codebase
@@ -30,11 +188,13 @@ def test_lint():
     plugin_args = ['--load-plugins', pylint_plugins] if pylint_plugins else []
     args = ['-m', 'pylint', '--rcfile={}'.format(rcpath)] + plugin_args + [
         '-f', 'html'
-    ] + pkg_paths
-    proc = SH.python3(*args)
-    out, err = proc
-    # TODO support funneling of calls
+    ]
     proj_path = os.environ.get("PYSH_PROJ_PATH", os.path.dirname(pkg_paths[0]))
+    # TODO checks spanning modules (e.g. duplicate-code) only see a shard
+    results = check('lint', args, pkg_paths, proj_path)
+    out = merge_html([out for _exit_code, out, _err in results])
+    err = "".join(err for _exit_code, _out, err in results)
+    # TODO support funneling of calls
     target_path = os.path.join(proj_path, 'lint.html')
     err_path = os.path.join(proj_path, 'lint_err.txt')
     if err:
@@ -44,7 +204,7 @@ def test_lint():
     with open(target_path, 'w') as target_file:
         target_file.write(out)
 
-    if proc.wait():
+    if any(exit_code for exit_code, _out, _err in results):
         raise TestFailure("Linting failed")
 
 
@@ -53,10 +213,11 @@ def test_yapf():
     Check current code-base for yapf formatting
     """
     pkg_paths = list(os.environ["PYSH_YAPF_PKG_PATH"].split(","))
-    proc = SH.python3('-m', 'yapf', '-d', '--recursive', *pkg_paths)
-    out, _err = proc
-    # TODO support funneling of calls
     proj_path = os.environ.get("PYSH_PROJ_PATH", os.path.dirname(pkg_paths[0]))
+    results = check('yapf', ['-m', 'yapf', '-d', '--recursive'], pkg_paths,
+                    proj_path)
+    out = "".join(out for _exit_code, out, _err in results)
+    # TODO support funneling of calls
     target_path = os.path.join(proj_path, 'yapf.txt')
     if out:
         with open(target_path, 'w') as target_file:
@@ -64,9 +225,38 @@ def test_yapf():
         raise TestFailure("Format check failed")
 
 
+def run_gates(unit_call, gates):
+    """
+    run the unit tests while running each quality gate in its own thread
+
+    yields a line for each gate and exits nonzero if anything failed
+    """
+    with futures.ThreadPoolExecutor(len(gates)) as pool:
+        # gates see the working directory of the command
+        results = [(gate, pool.submit(contextvars.copy_context().run, gate))
+                   for gate in gates]
+        out, err = unit_call
+        if err:
+            yield "stderr", err.rstrip("\n").split("\n")
+        if out:
+            yield out.rstrip("\n").split("\n")
+        failed = bool(unit_call.wait())
+        for gate, result in results:
+            try:
+                result.result()
+            except TestFailure as exc:
+                failed = True
+                yield "stderr", "{}: {}".format(gate.__name__, exc)
+            else:
+                yield "{}: passed".format(gate.__name__)
+    return 1 if failed else 0
+
+
 @pyshcommand
 @nottest
-def test(u: (bool, "Just unit tests for the package")=False):
+def test(u: (bool, "Just unit tests for the package")=False,
+         changed_by: (str, "Only lint and format check changed files, "
+                      "found by 'git' or 'mtime'")=None):
     """
     Run nose tests with coverage, yapf, and pylint
     """
@@ -84,26 +274,43 @@ def test(u: (bool, "Just unit tests for the package")=False):
     # TODO fix when shell supports exporting
     os.environ["PYSH_PYLINT_PKG_PATH"] = os.path.join(proj_dir, pkg_name)
     os.environ["PYSH_YAPF_PKG_PATH"] = os.path.join(proj_dir, pkg_name)
+    if changed_by:
+        os.environ["PYSH_CHECK_CHANGED"] = changed_by
+    unit_call = SH.python3('-m', 'nose', '--with-coverage', pkg_name)
     if u:
-        return SH.python3('-m', 'nose', '--with-coverage', pkg_name)
-    return SH.python3('-m', 'nose', '--with-coverage', pkg_name,
-                      'pysh.examples.development')
+        return unit_call
+    return FunctionCommand(run_gates, unit_call, [test_lint, test_yapf])
 
 
+@pyshtask(inputs=["Dockerfile", "setup.py", "requirements*.txt"])
 def build():
     """
     build any docker images associated with this project
     """
-    # TODO
-    raise NotImplementedError
+    if not os.path.exists(resolve_path("Dockerfile")):
+        return 0
+    tag = os.path.basename(getcwd())
+    return SH.docker('build', '-t', tag, getcwd())
 
 
+@pyshtask(
+    inputs=["setup.py", "requirements*.txt"], outputs=["venv/bin/python"])
 def mkvenv():
     """
     Create a virtual environment and install necessary packages
     """
-    # TODO
-    raise NotImplementedError
+    venv_path = resolve_path("venv")
+    exit_code = SH.python3('-m', 'venv', venv_path)()
+    if exit_code:
+        return exit_code
+    pip = getattr(SH, os.path.join(venv_path, 'bin', 'pip'))
+    for requirements in sorted(glob.glob(resolve_path("requirements*.txt"))):
+        exit_code = pip('install', '-r', requirements)()
+        if exit_code:
+            return exit_code
+    if os.path.exists(resolve_path("setup.py")):
+        return pip('install', '-e', getcwd())
+    return 0
 
 
 def enter():
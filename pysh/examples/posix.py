@@ -1,29 +1,190 @@
 """
 Pysh implementations of standard posix commands
 """
-from pysh.interface.command import FunctionCommand
+import collections
+import heapq
+import itertools
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
 
+from concurrent import futures
 
-@FunctionCommand.from_generator
-def grep(expression: (str, "The expression to match against"),
+from pysh.interface import stream
+from pysh.interface.command import FunctionCommand, resolve_path
+
+SCAN_BLOCK_SIZE = 16 * 1024 * 1024
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+SORT_BUFFER_SIZE = 64 * 1024 * 1024
+MERGE_WIDTH = 64
+
+
+def compile_expression(expression, as_bytes=False):
+    """
+    compile a regular expression, or a list of them any of which may
+    match, into a single regex
+    """
+    patterns = [expression] if isinstance(expression, str) else list(
+        expression)
+    if not patterns:
+        raise ValueError("No expressions to match against")
+    if len(patterns) == 1:
+        joined = patterns[0]
+    else:
+        joined = "|".join("(?:{})".format(pattern) for pattern in patterns)
+    if as_bytes:
+        joined = joined.encode("utf-8")
+    return re.compile(joined, re.MULTILINE)
+
+
+def match_lines(regex, lines, invert=False):
+    """
+    return the lines which match regex, or with invert the ones which don't
+    """
+    pattern = regex.pattern
+    if re.escape(pattern) == pattern:
+        # plain strings are quicker to find with in
+        return [line for line in lines if (pattern in line) ^ invert]
+    if invert:
+        return list(itertools.filterfalse(regex.search, lines))
+    return list(filter(regex.search, lines))
+
+
+def scan_block(regex, text, begin, end, invert=False):
+    """
+    return the lines of text[begin:end] which match regex, or with invert
+    the ones which don't
+
+    text may be a str, bytes or an mmap, its lines are newline separated
+    and there is no newline at end. The whole block is searched first so
+    that blocks without a match aren't split into lines and matched one
+    at a time.
+    """
+    newline = "\n" if isinstance(text, str) else b"\n"
+    if regex.search(text, begin, end) is None:
+        return text[begin:end].split(newline) if invert else []
+    return match_lines(regex, text[begin:end].split(newline), invert)
+
+
+def file_blocks(path, block_size=SCAN_BLOCK_SIZE):
+    """
+    return (begin, end) for each block of whole lines, of about block_size
+    bytes, in a file
+
+    end is the offset of the newline ending the block's last line, if
+    there is one
+    """
+    with open(path, 'rb') as src_file:
+        size = os.fstat(src_file.fileno()).st_size
+        if size == 0:
+            return []
+        with mmap.mmap(
+                src_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            blocks = []
+            begin = 0
+            while begin < size:
+                end = mapped.find(b"\n", begin + block_size)
+                if end == -1:
+                    end = size - 1 if mapped[size - 1] == ord("\n") else size
+                blocks.append((begin, end))
+                begin = end + 1
+    return blocks
+
+
+def scan_file_block(expression, invert, path, begin, end):
+    """
+    return the matching lines in a block of a file, as strs
+    """
+    regex = compile_expression(expression, as_bytes=True)
+    with open(path, 'rb') as src_file:
+        with mmap.mmap(
+                src_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            lines = scan_block(regex, mapped, begin, end, invert)
+    if not lines:
+        return []
+    return b"\n".join(lines).decode("utf-8", "replace").split("\n")
+
+
+def scan_in_parallel(expression, invert, blocks, max_workers=None):
+    """
+    yield the matching lines in each (path, begin, end) block, in order,
+    scanning blocks in parallel processes
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    # re holds the GIL, so scan in processes rather than threads
+    pool = futures.ProcessPoolExecutor(
+        max_workers, mp_context=multiprocessing.get_context("spawn"))
+    pending = collections.deque()
+    try:
+        for block in blocks:
+            pending.append(
+                pool.submit(scan_file_block, expression, invert, *block))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def filegrep(expression, invert, paths):
+    """
+    yield the lines of files which match expression, prefixed with their
+    file's path if there are several files
+
+    Files are mmap'd and scanned in large blocks, several large files in
+    parallel
+    """
+    exit_code = 0
+    blocks = []
+    block_paths = []
+    for path in paths:
+        try:
+            file_path = resolve_path(path)
+            for begin, end in file_blocks(file_path):
+                blocks.append((file_path, begin, end))
+                block_paths.append(path)
+        except OSError as exc:
+            yield "stderr", "grep: {}: {}".format(path, exc.strerror)
+            exit_code = 2
+    total_size = sum(end - begin for _path, begin, end in blocks)
+    if (len(paths) > 1 and total_size >= PARALLEL_MIN_SIZE and
+            (os.cpu_count() or 1) > 1):
+        results = scan_in_parallel(expression, invert, blocks)
+    else:
+        results = (scan_file_block(expression, invert, *block)
+                   for block in blocks)
+    for lines, path in zip(results, block_paths):
+        if len(paths) > 1:
+            lines = ["{}:{}".format(path, line) for line in lines]
+        if lines:
+            yield lines
+    return exit_code
+
+
+@FunctionCommand.from_batch_generator
+def grep(expression: (str, "The regular expression, or a list of them, "
+                      "to match against"),
          v: (bool, "Whether to match against complement")=False,
          *files: (str, "files to check")):
     """
     grep as a pysh command
     """
     if files:
-        # TODO implement
-        # yield from filegrep(expression, v, files)
-        raise StopIteration
-    line = yield None
-    while True:
-        if line is None:
-            break
-        # TODO regexp support
-        if (expression in line) ^ v:
-            line = yield line, True
+        return (yield from filegrep(expression, v, files))
+    regex = compile_expression(expression)
+    lines = yield None
+    while lines is not None:
+        if not lines:
+            matches = []
+        elif regex.search("\n".join(lines)) is None:
+            matches = lines if v else []
         else:
-            line = yield None
+            matches = match_lines(regex, lines, v)
+        lines = yield matches, True
 
 
 @FunctionCommand.from_generator
@@ -32,3 +193,262 @@ def echo(*args: (str, "Strings to write to stdout")):
     echo as a pysh command
     """
     yield " ".join(args)
+
+
+@FunctionCommand.from_bytes_generator
+def cat(*files: (str, "files to concatenate")):
+    """
+    cat as a pysh command
+
+    Files are copied to stdout by the kernel where it can, see
+    stream.transfer
+    """
+    if not files:
+        chunk = yield None
+        while chunk is not None:
+            chunk = yield chunk, True
+        return
+    exit_code = 0
+    for path in files:
+        try:
+            src_file = open(resolve_path(path), 'rb')
+        except OSError as exc:
+            yield "stderr", "cat: {}: {}".format(path, exc.strerror)
+            exit_code = 1
+            continue
+        # the file is closed once it has been written to stdout
+        yield src_file
+    return exit_code
+
+
+@FunctionCommand.from_batch_generator
+def head(n: (int, "The number of lines to output")=10):
+    """
+    head as a pysh command
+
+    Stops reading, and so stops the command it reads from, once it has
+    its lines
+    """
+    n = int(n)
+    if n <= 0:
+        return
+    lines = yield None
+    while lines is not None:
+        if len(lines) >= n:
+            yield lines[:n]
+            return
+        n -= len(lines)
+        lines = yield lines, True
+
+
+@FunctionCommand.from_batch_generator
+def tail(n: (int, "The number of lines to output")=10):
+    """
+    tail as a pysh command
+
+    Only the last n lines read are kept
+    """
+    last_lines = collections.deque(maxlen=int(n))
+    lines = yield None
+    while lines is not None:
+        last_lines.extend(lines)
+        lines = yield None
+    yield list(last_lines)
+
+
+@FunctionCommand.from_batch_generator
+def wc(l: (bool, "Whether to count lines")=False,
+       w: (bool, "Whether to count words")=False,
+       c: (bool, "Whether to count bytes")=False):
+    """
+    wc as a pysh command
+    """
+    # pylint: disable=invalid-name
+    if not (l or w or c):
+        l = w = c = True
+    counts = {'l': 0, 'w': 0, 'c': 0}
+    lines = yield None
+    while lines is not None:
+        if lines:
+            text = "\n".join(lines)
+            counts['l'] += len(lines)
+            if w:
+                counts['w'] += len(text.split())
+            if c:
+                counts['c'] += len(text.encode("utf-8")) + 1
+        lines = yield None
+    yield " ".join(
+        str(counts[flag]) for flag, wanted in [('l', l), ('w', w), ('c', c)]
+        if wanted)
+
+
+def parse_fields(fields):
+    """
+    return the sorted, non-overlapping (start, stop) slices of the fields
+    in a list like 1,3-5,7-
+    """
+    slices = []
+    for field_range in fields.split(","):
+        start, dash, stop = field_range.partition("-")
+        start = int(start) if start else 1
+        if not dash:
+            stop = start
+        stop = int(stop) if stop else None
+        if start < 1 or (stop is not None and stop < start):
+            raise ValueError("Invalid field range", field_range)
+        slices.append((start - 1, stop))
+    merged = []
+    for start, stop in sorted(slices, key=lambda bounds: bounds[0]):
+        if merged and (merged[-1][1] is None or start <= merged[-1][1]):
+            last_start, last_stop = merged.pop()
+            if last_stop is not None and stop is not None:
+                stop = max(stop, last_stop)
+            else:
+                stop = None
+            start = last_start
+        merged.append((start, stop))
+    return merged
+
+
+@FunctionCommand.from_batch_generator
+def cut(f: (str, "The fields to output, like 1,3-5,7-"),
+        d: (str, "The field delimiter")="\t"):
+    """
+    cut as a pysh command
+
+    Lines without the delimiter are output whole
+    """
+    slices = parse_fields(f)
+    lines = yield None
+    while lines is not None:
+        selected = []
+        for line in lines:
+            if d not in line:
+                selected.append(line)
+                continue
+            fields = line.split(d)
+            selected.append(
+                d.join(
+                    itertools.chain.from_iterable(
+                        fields[start:stop] for start, stop in slices)))
+        lines = yield selected, True
+
+
+@FunctionCommand.from_batch_generator
+def uniq(c: (bool, "Whether to prefix lines with their counts")=False):
+    """
+    uniq as a pysh command
+    """
+    previous = None
+    count = 0
+    lines = yield None
+    while lines is not None:
+        unique = []
+        for line, group in itertools.groupby(lines):
+            if line == previous:
+                count += sum(1 for _line in group)
+                continue
+            if count:
+                unique.append(
+                    "{:>7} {}".format(count, previous) if c else previous)
+            previous, count = line, sum(1 for _line in group)
+        lines = yield unique, True
+    if count:
+        yield "{:>7} {}".format(count, previous) if c else previous
+
+
+NUMERIC_PREFIX = re.compile(r"\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+
+
+def numeric_key(line):
+    """
+    return the key by which sort -n orders a line: its leading number,
+    0 if it has none, then the line itself
+    """
+    match = NUMERIC_PREFIX.match(line)
+    return float(match.group(1)) if match else 0.0, line
+
+
+def write_run(lines, tmp_dir):
+    """
+    write lines to a new file in tmp_dir and return its path
+    """
+    run_file = tempfile.NamedTemporaryFile(
+        'w', dir=tmp_dir, delete=False, encoding="utf-8", newline="\n")
+    with run_file:
+        for line in lines:
+            run_file.write(line)
+            run_file.write("\n")
+    return run_file.name
+
+
+def read_run(path):
+    """
+    yield the lines of a file written by write_run, removing it once they
+    have all been read
+    """
+    with open(path, encoding="utf-8", newline="\n") as run_file:
+        for line in run_file:
+            yield line[:-1]
+    os.unlink(path)
+
+
+def merge_runs(paths, key, reverse, tmp_dir, width=MERGE_WIDTH):
+    """
+    return an iterator over the merged lines of sorted run files
+
+    At most width files are merged at once, runs being merged into
+    longer runs first if there are more
+    """
+    while len(paths) > width:
+        paths = [
+            write_run(
+                heapq.merge(
+                    *[read_run(path) for path in paths[start:start + width]],
+                    key=key,
+                    reverse=reverse), tmp_dir)
+            for start in range(0, len(paths), width)
+        ]
+    return heapq.merge(
+        *[read_run(path) for path in paths], key=key, reverse=reverse)
+
+
+@FunctionCommand.from_batch_generator
+def sort(r: (bool, "Whether to reverse the order")=False,
+         n: (bool, "Whether to order lines by their leading number")=False,
+         S: (int, "The bytes of lines to sort in memory")=SORT_BUFFER_SIZE):
+    """
+    sort as a pysh command
+
+    Input that doesn't fit in memory is sorted in runs which are written
+    to temporary files and merged
+    """
+    # pylint: disable=invalid-name
+    key = numeric_key if n else None
+    buffer_size = int(S)
+    with tempfile.TemporaryDirectory(prefix="pysh-sort-") as tmp_dir:
+        run_paths = []
+        buffered = []
+        size = 0
+        lines = yield None
+        while lines is not None:
+            buffered.extend(lines)
+            size += sum(map(sys.getsizeof, lines))
+            if size >= buffer_size:
+                buffered.sort(key=key, reverse=r)
+                run_paths.append(write_run(buffered, tmp_dir))
+                buffered = []
+                size = 0
+            lines = yield None
+        buffered.sort(key=key, reverse=r)
+        if not run_paths:
+            yield buffered
+            return
+        if buffered:
+            run_paths.append(write_run(buffered, tmp_dir))
+        del buffered
+        merged = merge_runs(run_paths, key, r, tmp_dir)
+        batch = list(itertools.islice(merged, stream.BATCH_LINES))
+        while batch:
+            yield batch
+            batch = list(itertools.islice(merged, stream.BATCH_LINES))
@@ -0,0 +1,379 @@
+"""
+asyncio counterparts of the pysh shell interface
+
+    sh = AsyncShell()
+    out, err = await sh.ls()
+    async for line in sh.cat("log.txt") | sh.grep("ERROR"):
+        ...
+
+Subprocesses are run with asyncio.create_subprocess_exec and
+FunctionCommands are driven as async generators on the event loop, so one
+loop can run many pipelines without a thread per function.
+"""
+
+import asyncio
+import codecs
+import functools
+import io
+import os
+import subprocess
+import sys
+
+from pysh.interface import stream
+from pysh.interface.command import (FunctionCommand, ProcessCommand,
+                                    resolve_working_dir)
+from pysh.interface.shell import PartialCall, PipingCall, Shell, TeeCommand
+
+
+async def read_texts(reader, chunk_size=stream.CHUNK_SIZE):
+    """
+    yield the strs decoded from an asyncio StreamReader as they are read
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        chunk = await reader.read(chunk_size)
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+            yield text
+        if not chunk:
+            break
+
+
+async def split_texts(texts):
+    """
+    yield lists of the lines in an async iterator of strs
+    """
+    partial = ''
+    try:
+        async for text in texts:
+            lines = (partial + text).split("\n")
+            partial = lines.pop()
+            if lines:
+                yield lines
+        if partial:
+            yield [partial]
+    finally:
+        await texts.aclose()
+
+
+async def join_lines(batches):
+    """
+    yield the batches of lines from an async iterator as strs
+    """
+    try:
+        async for lines in batches:
+            yield "\n".join(lines) + "\n"
+    finally:
+        await batches.aclose()
+
+
+async def read_batches(reader, chunk_size=stream.CHUNK_SIZE):
+    """
+    yield lists of the lines read from an asyncio StreamReader
+    """
+    async for lines in split_texts(read_texts(reader, chunk_size)):
+        yield lines
+
+
+async def read_pipe(read_fd, texts=False):
+    """
+    yield lists of the lines read from the read end of a pipe, or the
+    strs read with texts
+
+    The pipe is closed as soon as the generator is, so its writer gets a
+    broken pipe if it is still writing
+    """
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader()
+    transport, _protocol = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader),
+        os.fdopen(read_fd, 'rb'))
+    try:
+        read = read_texts if texts else read_batches
+        async for output in read(reader):
+            yield output
+    finally:
+        transport.close()
+
+
+async def next_batch(batches):
+    """
+    return the next batch from an async iterator or None once it is done
+    """
+    if batches is None:
+        return None
+    try:
+        return await batches.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def feed(batches, writer):
+    """
+    write batches of lines to an asyncio StreamWriter, closing it after
+    """
+    try:
+        async for lines in batches:
+            writer.write(("\n".join(lines) + "\n").encode("utf-8"))
+            await writer.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        await batches.aclose()
+        writer.close()
+
+
+async def encode_batches(batches):
+    """
+    yield the batches of lines from an async iterator as bytes chunks, the
+    input of binary functions
+    """
+    if batches is None:
+        return
+    try:
+        async for lines in batches:
+            yield [("\n".join(lines) + "\n").encode("utf-8")]
+    finally:
+        await batches.aclose()
+
+
+def chunk_data(chunk):
+    """
+    yield the bytes of a chunk output by a binary function, reading and
+    closing it if it is a file
+    """
+    if not hasattr(chunk, 'read'):
+        yield chunk
+        return
+    with chunk:
+        yield from iter(functools.partial(chunk.read, stream.CHUNK_SIZE), b'')
+
+
+async def decode_chunks(batches):
+    """
+    yield the strs decoded from the bytes chunks output by a binary
+    function
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        async for chunks in batches:
+            for chunk in chunks:
+                for data in chunk_data(chunk):
+                    text = decoder.decode(data)
+                    if text:
+                        yield text
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+    finally:
+        await batches.aclose()
+
+
+class AsyncCommandCall(object):
+    """
+    An awaitable, asynchronously iterable wrapper of pysh commands
+
+    await the call to run it and get its (stdout, stderr) or iterate over
+    it with async for to get the lines of its stdout as they are produced
+    """
+
+    def __init__(self, command=None, commands=None):
+        self.commands = commands if commands else [command]
+        self.stages = list(self.commands)
+        self.processes = {}
+        self.tasks = []
+        self.stderr = None
+        self.status = None
+
+    def __or__(self, other):
+        return AsyncPipingCall(self.commands + other.commands)
+
+    def __await__(self):
+        return self.communicate().__await__()
+
+    def __aiter__(self):
+        return self.lines()
+
+    async def start(self, texts=False):
+        """
+        start every stage, returning an async iterator of the batches of
+        lines output by the last one, or of the strs it outputs with texts
+        """
+        if self.status is not None:
+            raise RuntimeError("Command already started")
+        self.status = 'called'
+        self.stderr = io.StringIO()
+        upstream = None
+        for index, stage in enumerate(self.stages):
+            next_stage = (self.stages[index + 1]
+                          if index + 1 < len(self.stages) else None)
+            as_texts = texts and next_stage is None
+            if isinstance(stage, TeeCommand):
+                raise NotImplementedError("Cannot run asynchronously", stage)
+            if isinstance(stage, FunctionCommand):
+                stage.resolve_working_dirs()
+                stderr = self.stderr if next_stage is None else sys.stderr
+                if stage.binary:
+                    upstream = decode_chunks(
+                        self.run_functions(stage, encode_batches(upstream),
+                                           stderr))
+                    if not as_texts:
+                        upstream = split_texts(upstream)
+                else:
+                    upstream = self.run_functions(stage, upstream, stderr)
+                    if as_texts:
+                        upstream = join_lines(upstream)
+            elif isinstance(stage, ProcessCommand):
+                upstream = await self.run_process(stage, upstream,
+                                                  next_stage, as_texts)
+            else:
+                raise NotImplementedError("Cannot run asynchronously", stage)
+        return upstream
+
+    async def run_process(self, stage, upstream, next_stage, texts=False):
+        """
+        start a subprocess, linking it directly to any neighbouring ones
+
+        With texts, its output is read as strs rather than lines
+        """
+        stdin = upstream
+        if upstream is not None and not isinstance(upstream, int):
+            stdin = subprocess.PIPE
+        read_fd, write_fd = os.pipe()
+        stderr = subprocess.PIPE if next_stage is None else None
+        process = await asyncio.create_subprocess_exec(
+            *stage.arguments,
+            executable=stage.executable,
+            cwd=resolve_working_dir(stage.working_dir),
+            stdin=stdin,
+            stdout=write_fd,
+            stderr=stderr)
+        self.processes[stage] = process
+        os.close(write_fd)
+        if isinstance(stdin, int) and stdin >= 0:
+            os.close(stdin)
+        if stdin == subprocess.PIPE:
+            self.tasks.append(
+                asyncio.ensure_future(feed(upstream, process.stdin)))
+        if next_stage is None:
+            self.tasks.append(
+                asyncio.ensure_future(self.read_stderr(process.stderr)))
+        if isinstance(next_stage, ProcessCommand):
+            return read_fd
+        return read_pipe(read_fd, texts)
+
+    async def read_stderr(self, reader):
+        """
+        collect the stderr of the last subprocess
+        """
+        async for text in read_texts(reader):
+            self.stderr.write(text)
+
+    async def run_functions(self, stage, upstream, stderr):
+        """
+        drive a FunctionCommand or FunctionChain, yielding batches of the
+        lines it outputs
+        """
+        writers = {'stderr': stream.LineWriter(stderr)}
+        drivers = stage.make_drivers(writers)
+        try:
+            while True:
+                lines = await self.pump(drivers, len(drivers) - 1, upstream)
+                if lines is None:
+                    break
+                yield lines
+                # let other tasks run between batches
+                await asyncio.sleep(0)
+        except Exception as exc:  # pylint: disable=broad-except
+            drivers[-1].fail(exc)
+        finally:
+            for writer in stage.writers(drivers):
+                writer.flush()
+            stage.complete(drivers)
+            if upstream is not None:
+                await upstream.aclose()
+
+    async def pump(self, drivers, index, upstream):
+        """
+        return the next lines output by drivers[index] or None once done
+        """
+        driver = drivers[index]
+        while True:
+            lines = driver.pull()
+            if lines:
+                return lines
+            if driver.finished:
+                return None
+            if index == 0:
+                for writer in FunctionCommand.writers(drivers):
+                    writer.flush()
+                driver.push(await next_batch(upstream))
+            else:
+                lines = await self.pump(drivers, index - 1, upstream)
+                driver.push(None if lines is None else stream.split_lines(
+                    lines))
+
+    async def lines(self):
+        """
+        run the command, yielding the lines of its stdout as they come
+        """
+        batches = await self.start()
+        try:
+            async for lines in batches:
+                for line in lines:
+                    yield line
+        finally:
+            await batches.aclose()
+            await self.wait()
+
+    async def communicate(self):
+        """
+        run the command and return its (stdout, stderr) as strs
+        """
+        texts = await self.start(texts=True)
+        out = []
+        try:
+            async for text in texts:
+                out.append(text)
+        finally:
+            await texts.aclose()
+            await self.wait()
+        return "".join(out), self.stderr.getvalue()
+
+    async def wait(self):
+        """
+        wait for every stage to finish, returning the last one's exit code
+        """
+        await asyncio.gather(*self.tasks)
+        for process in self.processes.values():
+            await process.wait()
+        tail = self.stages[-1]
+        if tail in self.processes:
+            return self.processes[tail].returncode
+        return tail.exit_code
+
+
+class AsyncPipingCall(AsyncCommandCall):
+    """
+    An AsyncCommandCall which pipes output from one command into another
+    """
+
+    def __init__(self, commands):
+        super().__init__(commands=commands)
+        self.stages = PipingCall.fuse(commands)
+
+
+class AsyncPartialCall(PartialCall):
+    """
+    A call which has not yet been given arguments, made asynchronously
+    """
+
+    command_call = AsyncCommandCall
+
+
+class AsyncShell(Shell):
+    """
+    A means to calling pysh commands from asyncio code
+    """
+
+    partial_call = AsyncPartialCall
@@ -0,0 +1,160 @@
+"""
+an on-disk store of the outputs of pysh commands
+
+Outputs are stored under a hash of everything they depend on (see
+command_key) so running a deterministic command again on unchanged inputs
+can replay its output rather than recompute it
+"""
+
+import functools
+import glob
+import hashlib
+import json
+import marshal
+import os
+
+from pysh.interface import stream
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def default_cache_dir():
+    """
+    return the directory in which command outputs are stored by default
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME",
+                                os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "pysh", "outputs")
+
+
+def hash_file(path):
+    """
+    return the sha256 hex digest of a file's contents
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as src_file:
+        for block in iter(lambda: src_file.read(stream.CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def command_identity(cmd):
+    """
+    return a description of a command factory which changes with its code
+    """
+    if isinstance(cmd, functools.partial):
+        return [command_identity(cmd.func), list(cmd.args), cmd.keywords]
+    name = "{}.{}".format(
+        getattr(cmd, '__module__', None),
+        getattr(cmd, '__qualname__', type(cmd).__qualname__))
+    code = getattr(cmd, '__code__', None)
+    if code is None:
+        return name
+    return [name, hashlib.sha256(marshal.dumps(code)).hexdigest()]
+
+
+def command_key(cmd, args, kwargs, working_dir, env=(), inputs=()):
+    """
+    return a hash of everything a cached command's output depends on
+
+    That is the command's code and arguments, the working directory, the
+    values of the environment variables named in env and the paths and
+    contents of the files matching the glob patterns in inputs
+    """
+    input_hashes = {}
+    for pattern in inputs:
+        paths = sorted(
+            glob.glob(os.path.join(working_dir, pattern), recursive=True))
+        input_hashes[pattern] = [(os.path.relpath(path, working_dir),
+                                  hash_file(path)) for path in paths
+                                 if os.path.isfile(path)]
+    description = {
+        'command': command_identity(cmd),
+        'arguments': [list(args), kwargs],
+        'working_dir': working_dir,
+        'env': {name: os.environ.get(name) for name in env},
+        'inputs': input_hashes,
+    }
+    serialized = json.dumps(description, sort_keys=True, default=repr)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class OutputCache(object):
+    """
+    A size-bounded store of command outputs
+
+    Each output is a json file named after its key. Reading an output
+    bumps its mtime and the least recently used outputs are evicted once
+    the store grows past max_size bytes.
+    """
+
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE):
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+
+    def entry_path(self, key):
+        """
+        return the path of the file storing the output for key
+        """
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, key):
+        """
+        return the output stored for key or None if there is none
+        """
+        path = self.entry_path(key)
+        try:
+            with open(path) as entry_file:
+                entry = json.load(entry_file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key, entry):
+        """
+        store the output for key, evicting old outputs if need be
+        """
+        path = self.entry_path(key)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        os.makedirs(self.path, exist_ok=True)
+        with open(tmp_path, 'w') as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self, max_size=None):
+        """
+        remove the least recently used outputs until under max_size bytes,
+        defaulting to the store's max_size
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if not os.path.isdir(self.path):
+            return
+        entries = []
+        with os.scandir(self.path) as dir_entries:
+            for dir_entry in dir_entries:
+                if not dir_entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = dir_entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size,
+                                dir_entry.path))
+        total_size = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, path in sorted(entries):
+            if total_size <= max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total_size -= size
+
+    def clear(self):
+        """
+        remove every stored output
+        """
+        self.evict(max_size=-1)
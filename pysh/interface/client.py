@@ -0,0 +1,142 @@
+"""
+thin client for running commands on a pysh server
+
+Kept free of imports of the rest of pysh so that asking a running server
+to run a command costs as little interpreter startup as possible
+"""
+
+import array
+import hashlib
+import json
+import os
+import socket
+import stat
+import struct
+import tempfile
+
+HEADER = struct.Struct("!I")
+# struct ucred, as returned for SO_PEERCRED
+PEER_CREDENTIALS = struct.Struct("3i")
+
+
+def socket_path(project_dir=None):
+    """
+    return the path of the server socket for a project directory
+    """
+    project_dir = os.path.abspath(project_dir or os.getcwd())
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir())
+    digest = hashlib.sha1(project_dir.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(runtime_dir, "pysh-{}".format(os.getuid()),
+                        digest + ".sock")
+
+
+def is_private_dir(path):
+    """
+    return True iff path is a directory, not a link, which only we own
+    and only we can use
+    """
+    try:
+        status = os.lstat(path)
+    except OSError:
+        return False
+    return (stat.S_ISDIR(status.st_mode) and status.st_uid == os.getuid() and
+            stat.S_IMODE(status.st_mode) == 0o700)
+
+
+def peer_uid(sock):
+    """
+    return the uid of the process at the other end of a unix socket or
+    None if the platform can't tell
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                  PEER_CREDENTIALS.size)
+    _pid, uid, _gid = PEER_CREDENTIALS.unpack(credentials)
+    return uid
+
+
+def is_trusted_peer(sock):
+    """
+    return False if the other end of a unix socket is run by another user
+    """
+    return peer_uid(sock) in [None, os.getuid()]
+
+
+def send_message(sock, message, fds=()):
+    """
+    send a length-prefixed json message, passing fds along with it
+    """
+    payload = json.dumps(message).encode("utf-8")
+    data = HEADER.pack(len(payload)) + payload
+    ancillary = []
+    if fds:
+        ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                      array.array("i", fds))]
+    sent = sock.sendmsg([data], ancillary)
+    if sent < len(data):
+        sock.sendall(data[sent:])
+
+
+def receive_message(sock, max_fds=0):
+    """
+    receive a length-prefixed json message and any fds passed with it
+
+    returns (message, fds), message being None if the peer hung up
+    """
+    fd_size = array.array("i").itemsize
+    data, ancillary, _flags, _address = sock.recvmsg(
+        HEADER.size, socket.CMSG_LEN(max_fds * fd_size))
+    fds = array.array("i")
+    for level, kind, fd_data in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(fd_data[:len(fd_data) - len(fd_data) % fd_size])
+    data = receive_exactly(sock, HEADER.size, data)
+    if data is None:
+        return None, list(fds)
+    (length, ) = HEADER.unpack(data)
+    payload = receive_exactly(sock, length)
+    if payload is None:
+        return None, list(fds)
+    return json.loads(payload.decode("utf-8")), list(fds)
+
+
+def receive_exactly(sock, size, data=b''):
+    """
+    keep reading until size bytes are read, returning None on hang up
+    """
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def request(command):
+    """
+    run a command on the server for the current directory
+
+    The command reads and writes this process's stdin, stdout and stderr
+    directly. Returns its exit code or None if no server could run it.
+    Our environment and channels are only handed to a server of our own,
+    listening in a directory no one else can use.
+    """
+    path = socket_path()
+    if not is_private_dir(os.path.dirname(path)) or not os.path.exists(path):
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+            if not is_trusted_peer(sock):
+                return None
+            send_message(sock, {
+                'command': list(command),
+                'env': dict(os.environ),
+            }, [0, 1, 2])
+            reply, _fds = receive_message(sock)
+        except OSError:
+            return None
+    if reply is None:
+        return None
+    return reply.get('exit_code')
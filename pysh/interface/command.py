@@ -2,12 +2,53 @@
 Command: an abstraction that wraps subprocs and functions in a similar interface
 """
 
+import collections
+import contextlib
+import contextvars
 import functools
 import os
+import signal
 import subprocess
 import sys
 import threading
-import tempfile
+import traceback
+
+from pysh.interface import cache, profiling, stream
+
+WORKING_DIR = contextvars.ContextVar('working_dir', default=None)
+
+
+def getcwd():
+    """
+    return the working directory of the FunctionCommand being run
+
+    FunctionCommands must resolve relative paths against this rather
+    than the process-wide working directory
+    """
+    working_dir = WORKING_DIR.get()
+    if working_dir is None:
+        return os.getcwd()
+    return os.path.abspath(working_dir)
+
+
+def resolve_working_dir(working_dir):
+    """
+    return a command's working directory made absolute against that of
+    the command starting it, or None if it has none
+
+    Nested shells like Shell('.') are then relative to the function using
+    them rather than to the process
+    """
+    if working_dir is None:
+        return None
+    return os.path.join(getcwd(), working_dir)
+
+
+def resolve_path(path):
+    """
+    return path relative to the working directory of the running command
+    """
+    return os.path.join(getcwd(), os.path.expanduser(path))
 
 
 class Command(object):
@@ -29,100 +70,207 @@ class FunctionCommand(object):
     def __init__(self, function, *args):
         self.function = function
         self.arguments = self.canonicalize(args)
+        self.batched = getattr(function, 'is_batched', False)
+        self.binary = getattr(function, 'is_binary', False)
         self.exit_code = None
+        self.exception = None
+        self.finished = threading.Event()
+        self.close_on_exit = []
+        self.working_dir = None
+        self.profile = None
         self.stdin = None
 
-    @staticmethod
-    def get_temp_path():
-        """
-        return a path to a temporary file
-        """
-        with tempfile.NamedTemporaryFile() as temp:
-            return temp.name
-
     def __call__(self, wait=True, **channels):
+        self.resolve_working_dirs()
         for std_channel in ['stdin', 'stdout', 'stderr']:
             if std_channel not in channels:
                 channels[std_channel] = getattr(sys, std_channel)
 
-        self.make_buffers(channels)
-        threading.Thread(target=self.execute, args=(channels, )).start()
+        ends, owned = self.make_buffers(channels, self.binary)
+        if channels['stderr'] is subprocess.STDOUT:
+            # like Popen, write stderr wherever stdout goes
+            channels['stderr'] = channels['stdout']
+            ends['stderr'] = None
+        threading.Thread(
+            target=self.execute, args=(channels, owned)).start()
         for channel_name in sorted(channels):
-            channel = channels[channel_name]
-            if isinstance(channel, str):
-                if channel_name == "stdin":
-                    self.stdin = open(channel, 'w')
-                else:
-                    setattr(self, channel_name, open(channel))
-            else:
-                setattr(self, channel_name, channel)
+            setattr(self, channel_name,
+                    ends.get(channel_name, channels[channel_name]))
         if wait:
             return self.wait()
 
-    def wait(self):
+    def wait(self, timeout=None):
         """
-        wait for command to finish running
+        wait for command to finish running and return its exit code
+
+        raises subprocess.TimeoutExpired if timeout seconds pass first
         """
-        while self.exit_code is None:
-            continue
+        if not self.finished.wait(timeout):
+            raise subprocess.TimeoutExpired(self.name, timeout)
         # TODO better return value for non-wait case?
         return self.exit_code
 
-    def make_buffers(self, channels):
+    def resolve_working_dirs(self):
+        """
+        make the working directory absolute before the function's thread,
+        which doesn't see the working directory of its caller, starts
         """
-        make any FIFOs used for PIPEing in and out of function
+        self.working_dir = resolve_working_dir(self.working_dir)
+
+    @property
+    def name(self):
+        """
+        the name of the function wrapped by this command
+        """
+        return getattr(self.function, '__name__', repr(self.function))
+
+    @staticmethod
+    def make_buffers(channels, binary=False):
+        """
+        make any pipes used for PIPEing in and out of function
+
+        replaces PIPE channels with the function's end of a new pipe and
+        returns the caller's ends along with the list of channels the
+        function is responsible for closing. With binary the caller's ends
+        of stdin and stdout are binary.
         """
+        ends = {}
+        owned = []
         for channel_key, channel_value in channels.items():
             if channel_value != subprocess.PIPE:
                 continue
-            path = self.get_temp_path()
-            os.mkfifo(path)
-            channels[channel_key] = path
-        # TODO figure out how to unlink FIFOs when done
+            read_fd, write_fd = os.pipe()
+            mode = 'b' if binary and channel_key != "stderr" else ''
+            if channel_key == "stdin":
+                channels[channel_key] = os.fdopen(read_fd, 'rb')
+                ends[channel_key] = os.fdopen(write_fd, 'w' + mode)
+            else:
+                channels[channel_key] = os.fdopen(write_fd, 'w' + mode)
+                ends[channel_key] = os.fdopen(read_fd, 'r' + mode)
+            owned.append(channels[channel_key])
+        return ends, owned
 
-    def execute(self, channels):
+    def execute(self, channels, owned=()):
         """
         Run the function and act like a subprocess
+
+        Input is read and output written in large blocks; output is
+        flushed whenever the function has to block waiting for input and
+        otherwise at most stream.FLUSH_DELAY seconds after it is yielded.
+        Binary functions read and write stdin and stdout in chunks of
+        bytes instead of lines. Channels in owned are closed once the
+        function is done.
         """
-        channels = dict(channels)
-        for channel_name in sorted(channels.keys()):
-            channel = channels[channel_name]
-            if isinstance(channel, str):
-                if channel_name == "stdin":
-                    channels['stdin'] = open(channel)
-                else:
-                    channels[channel_name] = open(channel, 'w')
+        writers = {
+            channel_name: stream.LineWriter(
+                channel, flush_delay=stream.FLUSH_DELAY)
+            for channel_name, channel in channels.items()
+            if channel_name != 'stdin'
+        }
+        stdout = channels['stdout']
+        if self.binary:
+            stdout = stream.binary_channel(stdout)
+            reader = stream.ChunkReader(channels['stdin'])
+        else:
+            reader = stream.LineReader(channels['stdin'])
+        if self.profile is not None:
+            self.profile.begin_thread(self.binary)
+            stdout = profiling.TimedChannel(stdout, self.profile)
+            reader = profiling.TimedReader(reader, self.profile)
+        if self.binary:
+            writers['stdout'] = stream.ChunkWriter(
+                stdout, flush_delay=stream.FLUSH_DELAY)
+        else:
+            writers['stdout'] = stream.LineWriter(
+                stdout, flush_delay=stream.FLUSH_DELAY)
+        drivers = self.make_drivers(writers)
+        try:
+            while True:
+                lines = self.pump(drivers, len(drivers) - 1, reader)
+                if lines is None:
+                    break
+                writers['stdout'].write_lines(lines)
+        except BrokenPipeError:
+            # the reader went away, act like a process killed by SIGPIPE
+            pass
+        except Exception as exc:  # pylint: disable=broad-except
+            drivers[-1].fail(exc)
+        finally:
+            for writer in writers.values():
+                with contextlib.suppress(BrokenPipeError):
+                    writer.flush()
+            for channel in list(owned) + self.close_on_exit:
+                with contextlib.suppress(BrokenPipeError):
+                    channel.close()
+            self.complete(drivers)
+
+    def complete(self, drivers):
+        """
+        record the exit codes of drivers and wake up anything waiting
+
+        stages the last one stopped reading from get a broken pipe
+        """
+        for driver in drivers:
+            driver.close(-signal.SIGPIPE)
+        for driver in drivers:
+            driver.command.exit_code = driver.exit_code
+            driver.command.exception = driver.exception
+            driver.command.finished.set()
+        self.exit_code = drivers[-1].exit_code
+        self.exception = drivers[-1].exception
+        if self.profile is not None and self.profile.kind is not None:
+            self.profile.end_thread(self.exit_code)
+        self.finished.set()
+
+    def make_drivers(self, writers):
+        """
+        return the GeneratorDrivers for the functions run by this command
+        """
+        return [GeneratorDriver(self, writers)]
 
-        gen = self.function(*self.arguments)
-        message = next(gen)
-        stdin = channels['stdin']
+    def pump(self, drivers, index, reader):
+        """
+        return the next lines output by drivers[index] or None once done
+
+        The first driver reads from reader, any others from the driver
+        before them
+        """
+        driver = drivers[index]
         while True:
-            outline, wantsline, end = self.parse_message(message)
-            if outline is not None:
-                out_channel, line = outline
-                channels.get(out_channel).write(line)
-                channels.get(out_channel).write(end)
-            try:
-                if wantsline:
-                    inline = self.decode(stdin.readline())
-                    sanitized_inline = inline.replace("\n",
-                                                      "") if inline else None
-                    message = gen.send(sanitized_inline)
-                else:
-                    message = next(gen)
-            except StopIteration:
-                break
-        # TODO should set code to 1 if exception happens
-        self.exit_code = 0
+            lines = driver.pull()
+            if lines:
+                return lines
+            if driver.finished:
+                return None
+            if index == 0:
+                for writer in self.writers(drivers):
+                    writer.flush()
+                driver.push(reader.readbatch())
+            else:
+                lines = self.pump(drivers, index - 1, reader)
+                driver.push(None if lines is None else stream.split_lines(
+                    lines))
+
+    @staticmethod
+    def writers(drivers):
+        """
+        return the distinct writers used by drivers
+        """
+        return {
+            id(writer): writer
+            for driver in drivers for writer in driver.writers.values()
+        }.values()
 
     @staticmethod
-    def decode(str_or_byte):
+    def exit_status(code):
         """
-        decode utf-8 bytes to str objects
+        convert a return value or SystemExit code to an exit status
         """
-        if isinstance(str_or_byte, str):
-            return str_or_byte
-        return str_or_byte.decode("utf-8")
+        if code is None:
+            return 0
+        if isinstance(code, int):
+            return code
+        return 1
 
     @staticmethod
     def parse_message(raw_message):
@@ -134,7 +282,10 @@ class FunctionCommand(object):
         message = list(raw_message)
         if message[-1] is None:
             message[-1] = True
-        if isinstance(message[-1], str):
+        # files are output too, see stream.ChunkWriter
+        output_types = (str, list, bytes, bytearray, memoryview)
+        if (isinstance(message[-1], output_types) or
+                hasattr(message[-1], 'read')):
             message.append(False)
         if len(message) == 1:
             return None, message[0], "\n"
@@ -162,6 +313,26 @@ class FunctionCommand(object):
 
         return wrapper
 
+    @classmethod
+    def from_batch_generator(cls, generator):
+        """
+        Create a FunctionCommand from a generator function which receives
+        lists of input lines (None at the end of input) and may yield
+        lists of output lines
+        """
+        generator.is_batched = True
+        return cls.from_generator(generator)
+
+    @classmethod
+    def from_bytes_generator(cls, generator):
+        """
+        Create a FunctionCommand from a generator function which receives
+        chunks of its stdin as bytes (None at the end of input) and may
+        yield bytes-like chunks, which are written to stdout as they are
+        """
+        generator.is_binary = True
+        return cls.from_generator(generator)
+
     @staticmethod
     def canonicalize(args):
         """
@@ -171,13 +342,183 @@ class FunctionCommand(object):
         return args
 
 
+class FunctionChain(FunctionCommand):
+    """
+    A chain of FunctionCommands piped into each other run as one command
+
+    The generators are driven in a single thread, each stage passing lists
+    of lines straight to the next. Only the last stage writes to the
+    chain's channels, the others write to sys.stderr like they would if
+    run on their own in a pipeline
+    """
+
+    def __init__(self, commands):
+        super().__init__(None)
+        self.commands = commands
+        # relative paths are in the directory of the function writing output
+        self.working_dir = commands[-1].working_dir
+
+    def resolve_working_dirs(self):
+        """
+        make the working directories of the chained functions absolute
+        """
+        super().resolve_working_dirs()
+        for command in self.commands:
+            command.resolve_working_dirs()
+
+    @property
+    def name(self):
+        """
+        the names of the chained functions
+        """
+        return " | ".join(command.name for command in self.commands)
+
+    def make_drivers(self, writers):
+        """
+        return a GeneratorDriver for each function in the chain
+        """
+        stage_writers = {
+            'stderr':
+            stream.LineWriter(sys.stderr, flush_delay=stream.FLUSH_DELAY)
+        }
+        *init, last = self.commands
+        return [GeneratorDriver(command, stage_writers) for command in init
+                ] + [GeneratorDriver(last, writers)]
+
+
+class GeneratorDriver(object):
+    """
+    Steps the generator of a FunctionCommand, feeding it input lines and
+    collecting the lines it yields to stdout
+
+    Lines yielded to any other channel, and to stdout if there is a
+    writer for it, are written to writers[channel]
+    """
+
+    def __init__(self, command, writers):
+        self.command = command
+        self.writers = writers
+        self.generator = None
+        self.inbox = collections.deque()
+        self.eof = False
+        self.wants_input = False
+        self.finished = False
+        self.exit_code = None
+        self.exception = None
+
+    @property
+    def blocked(self):
+        """
+        True iff the generator cannot make progress without more input
+        """
+        return (not self.finished and self.wants_input and not self.inbox and
+                not self.eof)
+
+    def push(self, lines):
+        """
+        queue a list of input lines, None marking the end of input
+        """
+        if lines is None:
+            self.eof = True
+        else:
+            self.inbox.extend(lines)
+
+    def pull(self):
+        """
+        run the generator until it blocks, finishes or yields to stdout
+
+        return the list of lines yielded to stdout, unless there is a
+        stdout writer which they are written to as they are yielded. In
+        either case they are passed on before the generator goes on,
+        maybe to block
+        """
+        out = []
+        if self.finished:
+            return out
+        command = self.command
+        token = WORKING_DIR.set(command.working_dir)
+        try:
+            if self.generator is None:
+                self.generator = command.function(*command.arguments)
+                self.receive(next(self.generator), out)
+            while not out:
+                if not self.wants_input:
+                    message = next(self.generator)
+                elif command.batched and (self.inbox or self.eof):
+                    lines = list(self.inbox) if self.inbox else None
+                    self.inbox.clear()
+                    message = self.generator.send(lines)
+                elif self.inbox:
+                    message = self.generator.send(self.inbox.popleft())
+                elif self.eof:
+                    message = self.generator.send(None)
+                else:
+                    break
+                self.receive(message, out)
+        except StopIteration as stop:
+            self.finish(command.exit_status(stop.value))
+        except SystemExit as exc:
+            self.finish(command.exit_status(exc.code))
+        except BrokenPipeError:
+            # stdout was closed on a line written to it, not a failure
+            raise
+        except Exception as exc:  # pylint: disable=broad-except
+            self.fail(exc)
+        finally:
+            WORKING_DIR.reset(token)
+        return out
+
+    def receive(self, message, out):
+        """
+        handle a message yielded from the generator
+        """
+        outline, self.wants_input, _end = self.command.parse_message(message)
+        if outline is None:
+            return
+        out_channel, line = outline
+        lines = line if isinstance(line, list) else [line]
+        if out_channel == 'stdout' and 'stdout' not in self.writers:
+            out.extend(lines)
+        else:
+            self.writers[out_channel].write_lines(lines)
+
+    def close(self, exit_code):
+        """
+        stop the generator early if it is still running
+        """
+        if self.finished:
+            return
+        if self.generator is not None:
+            self.generator.close()
+        self.finish(exit_code)
+
+    def finish(self, exit_code):
+        """
+        mark the generator as finished with an exit code
+        """
+        self.finished = True
+        self.exit_code = exit_code
+
+    def fail(self, exc):
+        """
+        mark the generator as failed, reporting the exception on stderr
+        """
+        self.exception = exc
+        self.finish(1)
+        self.writers['stderr'].write(traceback.format_exc())
+
+
 class ProcessCommand(object):
     """
     A pysh command wrapping a subprocess
     """
 
-    def __init__(self, proc_name, *args):
+    def __init__(self, proc_name, *args, executable=None):
         self.arguments = [proc_name] + self.canonicalize(args)
+        self.executable = executable
+        self.working_dir = None
+        self.profile = None
+        self.watcher = None
         self.subproc = None
 
     def __call__(self, wait=True, **channels):
@@ -185,24 +526,37 @@ class ProcessCommand(object):
         unknown_channels = {key for key in channels if key not in stdchannels}
         if unknown_channels:
             raise ValueError("Unknown channels", unknown_channels)
-        self.subproc = subprocess.Popen(self.arguments, **channels)
+        self.subproc = subprocess.Popen(
+            self.arguments,
+            executable=self.executable,
+            cwd=resolve_working_dir(self.working_dir),
+            **channels)
+        if self.profile is not None:
+            self.watcher = self.profile.watch_process(self.subproc)
         for channel in stdchannels:
             setattr(self, channel, getattr(self.subproc, channel))
         if wait:
             return self.wait()
 
-    def wait(self):
+    def wait(self, timeout=None):
         """
         wait for the subprocess to finish
         """
-        return self.subproc.wait()
+        if self.watcher is not None:
+            self.watcher.join(timeout)
+            if self.watcher.is_alive():
+                raise subprocess.TimeoutExpired(self.arguments, timeout)
+            return self.subproc.returncode
+        return self.subproc.wait(timeout)
 
     @classmethod
-    def from_proc_name(cls, proc_name):
+    def from_proc_name(cls, proc_name, executable=None):
         """
         create a ProcessCommand given a process name
+
+        executable is the already resolved path of the program to run
         """
-        return functools.partial(cls, proc_name)
+        return functools.partial(cls, proc_name, executable=executable)
 
     @staticmethod
     def canonicalize(args):
@@ -227,3 +581,68 @@ def pyshcommand(cmd):
 
     wrapper.is_pysh_command = True
     return wrapper
+
+
+def cachedcommand(inputs=(), env=(), store=None):
+    """
+    decorator memoizing the output of a deterministic pysh command
+
+    The decorated command factory is only run again once its code,
+    arguments or working directory, the environment variables named in
+    env or the files matching the glob patterns in inputs change. Until
+    then its stdout, stderr and exit code are replayed from store, an
+    OutputCache. The factory may return a FunctionCommand, a
+    ProcessCommand or a CommandCall.
+
+        @pyshcommand
+        @cachedcommand(inputs=["pysh/**/*.py"], env=["PYTHONPATH"])
+        def lint():
+            return SH.pylint("pysh")
+    """
+
+    def decorator(cmd):
+        """
+        wrap a command factory so its commands are cached
+        """
+
+        @functools.wraps(cmd)
+        def wrapper(*args, **kwargs):
+            """
+            create a FunctionCommand replaying the command's output
+            """
+            return FunctionCommand(run_cached, cmd, args, kwargs, inputs,
+                                   env, store)
+
+        return wrapper
+
+    return decorator
+
+
+def run_cached(cmd, args, kwargs, inputs, env, store):
+    """
+    replay the output of cmd(*args, **kwargs), running it if not cached
+
+    The command's output is only written once it has finished
+    """
+    # TODO find a home for CommandCall that doesn't import this module
+    from pysh.interface.shell import CommandCall
+    store = store or cache.OutputCache()
+    working_dir = getcwd()
+    key = cache.command_key(cmd, args, kwargs, working_dir, env, inputs)
+    entry = store.get(key)
+    if entry is None:
+        command = cmd(*args, **kwargs)
+        if isinstance(command, (FunctionCommand, ProcessCommand)):
+            command.working_dir = working_dir
+        if not isinstance(command, CommandCall):
+            command = CommandCall(command)
+        out, err = command.communicate()
+        entry = {'stdout': out, 'stderr': err, 'exit_code': command.wait()}
+        store.put(key, entry)
+    for channel_name in ['stderr', 'stdout']:
+        lines = entry[channel_name].split("\n")
+        if lines[-1] == '':
+            lines.pop()
+        if lines:
+            yield channel_name, lines
+    return entry['exit_code']
@@ -3,9 +3,9 @@ requisites for running pysh in interactive mode
 """
 
 import importlib.machinery
+import importlib.util
 import os
 import sys
-import types
 
 import pysh
 
@@ -50,54 +50,60 @@ class PyshImportHook(object):
     def find_spec(self, fullname, _path, _target=None):
         """
         Find a module spec for an import path
+
+        Scopes are packages whose commands and config submodules are only
+        imported when asked for, so looking up a command in one scope does
+        not load the others
         """
         if fullname.startswith("pysh.scopes."):
             if fullname.startswith(
                     "pysh.scopes.standard") or fullname.startswith(
                         "pysh.scopes.current"):
                 return None
-            return importlib.machinery.ModuleSpec(fullname, self)
+            parts = fullname.split(".")
+            if len(parts) == 3:
+                # TODO consider getting from __init__.py
+                return importlib.machinery.ModuleSpec(
+                    fullname, self, is_package=True)
+            if len(parts) > 4:
+                raise NotImplementedError
+            if parts[-1] not in ['commands', 'config']:
+                return None
+            return self.find_submodule_spec(fullname)
 
-    def load_module(self, name):
+    def find_submodule_spec(self, name):
         """
-        Load a module spec for an import path
+        Find the spec of the commands or config submodule of a scope
+
+        Existing source files are loaded like regular imports, caching
+        their compiled code in __pycache__ next to the source
         """
-        if self.is_valid_scope(name):
-            pyshdir = self.find_pysh_scope(name)
-        else:
-            raise ValueError("Unknown pysh scope", name)
-        parts = name.split(".")
-        if len(parts) > 4:
-            raise NotImplementedError
-        # TODO consider getting from __init__.py
-        root_module = self.make_and_cache_module(name, '')
-        for submodule in ['commands', 'config']:
-            src_path = os.path.join(pyshdir, submodule + '.py')
-            if os.path.exists(src_path):
-                with open(src_path) as src_file:
-                    source = src_file.read()
-            else:
-                source = ''
-                src_path = None
-            submodule_name = "{}.{}".format(name, submodule)
-            module = self.make_and_cache_module(submodule_name, source,
-                                                src_path)
-            setattr(root_module, submodule, module)
+        scope_name, submodule = name.rsplit(".", 1)
+        if not self.is_valid_scope(scope_name):
+            raise ValueError("Unknown pysh scope", scope_name)
+        src_path = os.path.join(
+            self.find_pysh_scope(scope_name), submodule + '.py')
+        if os.path.exists(src_path):
+            return importlib.util.spec_from_file_location(name, src_path)
+        return importlib.machinery.ModuleSpec(name, self)
 
     @staticmethod
-    def make_and_cache_module(name, source, src_path=None):
+    def create_module(_spec):
+        """
+        Use the default module creation for scopes
         """
-        Make a module and store it in the system cache
+        return None
+
+    def exec_module(self, module):
         """
-        if src_path is None:
-            src_path = name
-        module = types.ModuleType(name, source)
+        Initialize a scope or one of its missing (so empty) submodules
+        """
+        name = module.__name__
+        scope_name = ".".join(name.split(".")[:3])
+        if not self.is_valid_scope(scope_name):
+            raise ValueError("Unknown pysh scope", name)
         # TODO set full path
-        module.__file__ = src_path
-        byte_code = compile(source, name, 'exec')
-        exec(byte_code, module.__dict__)
-        sys.modules[name] = module
-        return module
+        module.__file__ = name
 
     @staticmethod
     def is_valid_scope(name):
@@ -140,6 +146,56 @@ class PyshImportHook(object):
         return ".pysh"
 
 
+class CommandCompleter(object):
+    """
+    tab-completes pysh command names along with python names
+    """
+
+    def __init__(self, namespace, command_index):
+        import rlcompleter
+        self.completer = rlcompleter.Completer(namespace)
+        self.command_index = command_index
+        self.matches = []
+
+    def complete(self, text, state):
+        """
+        return the state'th completion of text, as readline expects
+        """
+        if state == 0:
+            self.matches = list(self.python_matches(text))
+            if "." not in text:
+                self.matches.extend(
+                    name + "(" for name in self.command_index.complete(text)
+                    if name + "(" not in self.matches)
+        if state < len(self.matches):
+            return self.matches[state]
+        return None
+
+    def python_matches(self, text):
+        """
+        yield the completions python itself would give for text
+        """
+        state = 0
+        match = self.completer.complete(text, state)
+        while match is not None:
+            yield match
+            state += 1
+            match = self.completer.complete(text, state)
+
+
+def install_completer(command_index):
+    """
+    tab-complete pysh commands in interactive mode, if readline is around
+    """
+    try:
+        import readline
+    except ImportError:
+        return
+    readline.set_completer(
+        CommandCompleter(globals(), command_index).complete)
+    readline.parse_and_bind("tab: complete")
+
+
 def import_module(module_name, get=None):
     """
     replacement for import statements -- used in interactive mode
@@ -155,17 +211,29 @@ def import_module(module_name, get=None):
     globals()[parts[0]] = __import__(module_name)
 
 
-def patch_and_run(*command):
+def patch_and_run(*command, profile=False):
     """
     do all patching necessary to run pysh in interactive mode
+
+    If a command is given it is run instead, and with profile its profile
+    is written to stderr once it is done
     """
     sys.stdout = OutWrapper()
     sys.meta_path.insert(0, PyshImportHook())
-    chain = shell.FallbackChain(globals()['__builtins__'], shell.Shell())
+    pysh_shell = shell.Shell()
+    chain = shell.FallbackChain(globals()['__builtins__'], pysh_shell)
     globals()['__builtins__'] = chain
     globals()['prt'] = import_module
     if command:
-        exit(getattr(chain, command[0])(*command[1:])())
+        call = getattr(chain, command[0])(*command[1:])
+        if profile and hasattr(call, 'profiled'):
+            call.profiled()
+        exit_code = call()
+        if profile and getattr(call, 'profile', None) is not None:
+            for line in call.profile.format():
+                sys.stderr.write(line + "\n")
+        exit(exit_code)
+    install_completer(pysh_shell.command_index)
 
 
 def main():
@@ -0,0 +1,291 @@
+"""
+manifests of the names and commands defined by scope modules
+
+A manifest is cached next to a module's bytecode and lets a shell tell
+whether a scope defines a command, and describe it, without importing the
+scope
+"""
+
+import importlib
+import importlib.util
+import inspect
+import json
+import os
+import sys
+
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 2
+
+
+def find_source(module_name):
+    """
+    return the path of a module's source file without importing it
+
+    returns None if the module has no source file
+    """
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or not spec.has_location or not spec.origin:
+        return None
+    if not spec.origin.endswith(".py"):
+        return None
+    return spec.origin
+
+
+def manifest_path(src_path):
+    """
+    return the path of the manifest for a source file
+    """
+    try:
+        cache_path = importlib.util.cache_from_source(src_path)
+    except NotImplementedError:
+        return None
+    return os.path.splitext(cache_path)[0] + MANIFEST_SUFFIX
+
+
+def source_key(src_path):
+    """
+    return the mtime and size of a source file, as used for bytecode
+    """
+    stat = os.stat(src_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def read_manifest(path, key):
+    """
+    return the manifest at path if it is up to date with key, else None
+    """
+    try:
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get('source') != key:
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(path, manifest):
+    """
+    atomically write a manifest, giving up silently if we cannot
+    """
+    tmp_path = "{}.{}".format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def module_names(module):
+    """
+    return the names a module defines, leaving out special names like
+    __doc__, or None if they cannot be known
+    """
+    names = dir(module)
+    if '__getattr__' in names:
+        return None
+    return [name for name in names if not name.startswith("__")]
+
+
+def describe_command(command):
+    """
+    return the first line of a command's docstring and its signature
+    """
+    doc_lines = (command.__doc__ or '').strip().split("\n")
+    try:
+        signature = str(inspect.signature(command))
+    except (TypeError, ValueError):
+        signature = None
+    return {'doc': doc_lines[0].strip(), 'signature': signature}
+
+
+def module_commands(module, names):
+    """
+    return descriptions of the pysh commands among a module's names
+    """
+    commands = {}
+    for name in names:
+        attr = getattr(module, name, None)
+        if getattr(attr, 'is_pysh_command', False) is True:
+            commands[name] = describe_command(attr)
+    return commands
+
+
+class LazyScope(object):
+    """
+    A search object standing in for a scope module until it is needed
+
+    Until the scope is imported, the names it defines are read from its
+    manifest and it is only imported once one of them is asked for. The
+    manifest is rebuilt (by importing the scope) whenever its source
+    changes. Names a scope gets from other modules are only picked up
+    again once the scope's own source changes.
+    """
+
+    def __init__(self, module_name):
+        self.__name__ = module_name
+        self._module = None
+        self._names = None
+        self._commands = None
+        self._names_read = False
+
+    def __getattr__(self, attr_name):
+        if attr_name.startswith("__"):
+            # don't import scopes for special lookups like copy's
+            raise AttributeError(attr_name)
+        if not self._is_loaded():
+            names = self._get_names()
+            if names is not None and attr_name not in names:
+                raise AttributeError(attr_name)
+        return getattr(self._load(), attr_name)
+
+    def __dir__(self):
+        if self._is_loaded() or self._get_names() is None:
+            return [
+                name for name in dir(self._load())
+                if not name.startswith("__")
+            ]
+        return sorted(self._get_names())
+
+    def __repr__(self):
+        return "<LazyScope {!r}>".format(self.__name__)
+
+    def _is_loaded(self):
+        """
+        return True iff the scope has been imported
+
+        Once it has, the module itself rather than its manifest says what
+        names it defines
+        """
+        return self._module is not None or self.__name__ in sys.modules
+
+    def _load(self):
+        """
+        import the scope module
+        """
+        if self._module is None:
+            self._module = importlib.import_module(self.__name__)
+        return self._module
+
+    def _get_names(self):
+        """
+        return the set of names the scope defines or None if unknown
+        """
+        self._read_manifest()
+        return self._names
+
+    def _get_commands(self):
+        """
+        return descriptions of the pysh commands the scope defines
+        """
+        if self._is_loaded():
+            return module_commands(self._load(), dir(self))
+        self._read_manifest()
+        if self._commands is None:
+            return module_commands(self._load(), dir(self))
+        return self._commands
+
+    def _read_manifest(self):
+        """
+        read the scope's manifest, rebuilding it if stale
+        """
+        if self._names_read:
+            return
+        self._names_read = True
+        src_path = find_source(self.__name__)
+        if src_path is None:
+            return
+        path = manifest_path(src_path)
+        try:
+            key = source_key(src_path)
+        except OSError:
+            return
+        manifest = None if path is None else read_manifest(path, key)
+        if manifest is None:
+            module = self._load()
+            names = module_names(module)
+            if names is None:
+                return
+            manifest = {
+                'version': MANIFEST_VERSION,
+                'source': key,
+                'names': names,
+                'commands': module_commands(module, names),
+            }
+            if path is not None:
+                write_manifest(path, manifest)
+        self._names = set(manifest['names'])
+        self._commands = manifest['commands']
+
+
+class CommandIndex(object):
+    """
+    An index of the pysh commands defined by a list of search objects
+
+    Each command is described by the scope it comes from, the first line
+    of its docstring and its signature. Descriptions come from the scopes'
+    manifests, so describing commands doesn't import scopes whose source
+    is unchanged.
+    """
+
+    def __init__(self, search_objs):
+        self.search_objs = search_objs
+        self.entries = None
+
+    def refresh(self):
+        """
+        forget every described command
+        """
+        self.entries = None
+
+    def scopes(self):
+        """
+        return a list of (scope name, {command name: description}) pairs
+        """
+        return [(search_obj.__name__, self.scope_commands(search_obj))
+                for search_obj in self.search_objs]
+
+    @staticmethod
+    def scope_commands(search_obj):
+        """
+        return descriptions of the commands defined by a search object
+        """
+        if isinstance(search_obj, LazyScope):
+            # pylint: disable=protected-access
+            return search_obj._get_commands()
+        return module_commands(search_obj, dir(search_obj))
+
+    def get_entries(self):
+        """
+        return a dict of every command name to its description
+        """
+        if self.entries is None:
+            self.entries = {}
+            for scope_name, commands in reversed(self.scopes()):
+                for name, description in commands.items():
+                    self.entries[name] = dict(
+                        description, name=name, scope=scope_name)
+        return self.entries
+
+    def get(self, cmd_name):
+        """
+        return the description of a command or None if there is none
+        """
+        return self.get_entries().get(cmd_name)
+
+    def complete(self, prefix):
+        """
+        return the sorted names of the commands starting with prefix
+        """
+        return sorted(name for name in self.get_entries()
+                      if name.startswith(prefix))
@@ -0,0 +1,327 @@
+"""
+opt-in profiling of the stages of pysh calls
+
+    call = (sh.cat("log.txt") | sh.grep("ERROR")).profiled()
+    call()
+    call.profile.report()
+
+For every stage a StageProfile records its start and end times, the CPU
+time it used, what it read and wrote, how long it was blocked reading and
+writing and its exit code
+"""
+
+import os
+import threading
+import time
+
+from pysh.interface import stream
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+REPORT_FIELDS = [
+    'name', 'kind', 'start', 'end', 'wall', 'cpu_user', 'cpu_system',
+    'bytes_in', 'lines_in', 'bytes_out', 'lines_out', 'read_wait',
+    'write_wait', 'exit_code'
+]
+
+
+def stage_name(stage):
+    """
+    return a name for a stage of a call
+    """
+    name = getattr(stage, 'name', None)
+    if name is not None:
+        return name
+    return " ".join(getattr(stage, 'arguments', [repr(stage)]))
+
+
+def thread_usage():
+    """
+    return the (user, system) CPU time used by the current thread
+    """
+    if resource is not None and hasattr(resource, 'RUSAGE_THREAD'):
+        usage = resource.getrusage(resource.RUSAGE_THREAD)
+        return usage.ru_utime, usage.ru_stime
+    return time.thread_time(), 0.0
+
+
+class StageProfile(object):
+    """
+    Timings and counters for one stage of a call
+
+    Times are from time.monotonic. Functions count the lines and utf-8
+    bytes they read and write to stdout and the time spent blocked doing
+    so. Processes count every byte they read or write (on Linux) and the
+    CPU time in their rusage; their lines and blocked times are unknown
+    and left as None.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.kind = None
+        self.start = None
+        self.end = None
+        self.cpu_user = None
+        self.cpu_system = None
+        self.bytes_in = None
+        self.lines_in = None
+        self.bytes_out = None
+        self.lines_out = None
+        self.read_wait = None
+        self.write_wait = None
+        self.exit_code = None
+        self.thread_start = None
+
+    def begin_thread(self, binary=False):
+        """
+        start profiling a function run by the current thread
+
+        The lines of binary functions aren't counted
+        """
+        self.kind = 'function'
+        self.start = time.monotonic()
+        self.thread_start = thread_usage()
+        self.bytes_in = self.bytes_out = 0
+        if not binary:
+            self.lines_in = self.lines_out = 0
+        self.read_wait = self.write_wait = 0.0
+
+    def end_thread(self, exit_code):
+        """
+        stop profiling a function run by the current thread
+        """
+        self.end = time.monotonic()
+        user, system = thread_usage()
+        self.cpu_user = user - self.thread_start[0]
+        self.cpu_system = system - self.thread_start[1]
+        self.exit_code = exit_code
+
+    def watch_process(self, subproc):
+        """
+        start profiling a subprocess, returning the thread waiting for it
+
+        The thread reaps the subprocess itself to get its rusage
+        """
+        self.kind = 'process'
+        self.start = time.monotonic()
+        thread = threading.Thread(
+            target=self.wait_process, args=(subproc, ), daemon=True)
+        thread.start()
+        return thread
+
+    def wait_process(self, subproc):
+        """
+        wait for a subprocess to exit and record its profile
+        """
+        pid = subproc.pid
+        try:
+            if hasattr(os, 'waitid'):
+                # wait without reaping so that /proc/<pid> is still there
+                os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+                self.end = time.monotonic()
+                self.read_process_io(pid)
+            _pid, status, usage = os.wait4(pid, 0)
+        except ChildProcessError:
+            # someone else reaped the subprocess
+            subproc.wait()
+        else:
+            subproc.returncode = os.waitstatus_to_exitcode(status)
+            self.cpu_user, self.cpu_system = usage.ru_utime, usage.ru_stime
+        if self.end is None:
+            self.end = time.monotonic()
+        self.exit_code = subproc.returncode
+
+    def read_process_io(self, pid):
+        """
+        record the bytes read and written by a process, if we can
+        """
+        try:
+            with open("/proc/{}/io".format(pid)) as io_file:
+                counters = dict(
+                    line.split(": ") for line in io_file.read().splitlines())
+        except (OSError, ValueError):
+            return
+        self.bytes_in = int(counters.get('rchar', 0))
+        self.bytes_out = int(counters.get('wchar', 0))
+
+    @property
+    def wall(self):
+        """
+        the time between the stage starting and ending
+        """
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    def as_dict(self, origin=0.0):
+        """
+        return the profile as a dict, with times relative to origin
+        """
+        profile = {field: getattr(self, field) for field in REPORT_FIELDS}
+        for field in ['start', 'end']:
+            if profile[field] is not None:
+                profile[field] -= origin
+        return profile
+
+
+class TimedReader(object):
+    """
+    Wraps a LineReader or ChunkReader, recording what is read and how long
+    it blocks
+    """
+
+    def __init__(self, reader, profile):
+        self.reader = reader
+        self.profile = profile
+
+    def readbatch(self):
+        """
+        return the next list of lines, as LineReader.readbatch
+        """
+        start = time.monotonic()
+        lines = self.reader.readbatch()
+        self.profile.read_wait += time.monotonic() - start
+        if lines and self.profile.lines_in is None:
+            self.profile.bytes_in += sum(len(chunk) for chunk in lines)
+        elif lines:
+            self.profile.lines_in += len(lines)
+            self.profile.bytes_in += len(
+                "\n".join(lines).encode("utf-8")) + 1
+        return lines
+
+
+class TimedChannel(object):
+    """
+    Wraps a writable channel, recording what is written and how long it
+    blocks
+    """
+
+    def __init__(self, channel, profile):
+        self.channel = channel
+        self.profile = profile
+
+    def write(self, text):
+        """
+        write text, or bytes to a binary channel, to the channel
+        """
+        start = time.monotonic()
+        self.channel.write(text)
+        self.profile.write_wait += time.monotonic() - start
+        if not isinstance(text, str):
+            self.profile.bytes_out += memoryview(text).nbytes
+            return
+        self.profile.lines_out += text.count("\n")
+        self.profile.bytes_out += len(text.encode("utf-8"))
+
+    def transfer(self, src):
+        """
+        copy the rest of the file src to the channel, see stream.transfer
+        """
+        start = time.monotonic()
+        size = stream.transfer(src, self.channel)
+        self.profile.write_wait += time.monotonic() - start
+        self.profile.bytes_out += size
+        return size
+
+    def flush(self):
+        """
+        flush the channel
+        """
+        flush = getattr(self.channel, 'flush', None)
+        if flush is None:
+            return
+        start = time.monotonic()
+        flush()
+        self.profile.write_wait += time.monotonic() - start
+
+    def __getattr__(self, attr_name):
+        return getattr(self.channel, attr_name)
+
+
+class CallProfile(object):
+    """
+    The StageProfiles of every stage of a call
+
+    Attaches a StageProfile to each stage, which the stage fills in as it
+    runs
+    """
+
+    def __init__(self, stages):
+        self.start = None
+        self.end = None
+        self.stages = []
+        for stage in self.flatten(stages):
+            stage.profile = StageProfile(stage_name(stage))
+            self.stages.append(stage.profile)
+
+    @classmethod
+    def flatten(cls, stages):
+        """
+        return the commands run by stages, looking inside nested calls
+        """
+        commands = []
+        for stage in stages:
+            if hasattr(stage, 'stages'):
+                commands.extend(cls.flatten(stage.stages))
+            else:
+                commands.append(stage)
+        return commands
+
+    def begin(self):
+        """
+        mark the call as started
+        """
+        self.start = time.monotonic()
+
+    def finish(self):
+        """
+        mark the call as finished
+        """
+        self.end = time.monotonic()
+
+    def report(self):
+        """
+        return the profile of the call as a dict
+        """
+        origin = self.start or 0.0
+        wall = None if self.end is None else self.end - origin
+        return {
+            'wall': wall,
+            'stages': [stage.as_dict(origin) for stage in self.stages],
+        }
+
+    def format(self):
+        """
+        return the profile of the call as a table of lines
+        """
+        columns = [
+            ('stage', 'name'), ('wall', 'wall'), ('user', 'cpu_user'),
+            ('sys', 'cpu_system'), ('in bytes', 'bytes_in'),
+            ('in lines', 'lines_in'), ('out bytes', 'bytes_out'),
+            ('out lines', 'lines_out'), ('read wait', 'read_wait'),
+            ('write wait', 'write_wait'), ('exit', 'exit_code')
+        ]
+        rows = [[header for header, _field in columns]]
+        for stage in self.report()['stages']:
+            rows.append(
+                [format_value(stage[field]) for _header, field in columns])
+        widths = [max(len(row[index]) for row in rows)
+                  for index in range(len(columns))]
+        return [
+            "  ".join(cell.ljust(width) for cell, width in zip(row, widths))
+            .rstrip() for row in rows
+        ]
+
+
+def format_value(value):
+    """
+    format a value in a profile table
+    """
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return "{:.3f}".format(value)
+    return str(value)
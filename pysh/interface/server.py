@@ -0,0 +1,169 @@
+"""
+a long-lived pysh server which keeps scopes imported between commands
+
+Started with `pysh --serve` in a project directory. `pysh <cmd>` then
+hands its arguments, environment and standard channels to the server over
+a unix socket instead of starting pysh from scratch.
+"""
+
+import builtins
+import contextlib
+import os
+import socket
+import sys
+import traceback
+
+from pysh.interface import client, hook, shell
+from pysh.interface.command import FunctionCommand
+
+
+class Server(object):
+    """
+    Runs pysh commands sent by clients, one at a time
+
+    The server gives up (and tells its client to run the command itself)
+    as soon as the source of any scope changes
+    """
+
+    def __init__(self, path=None, search_path=shell.SEARCH_PATH):
+        self.path = path or client.socket_path()
+        self.chain = shell.FallbackChain(builtins,
+                                         shell.Shell(search_path=search_path))
+        self.mtimes = self.get_scope_mtimes()
+
+    @staticmethod
+    def get_scope_mtimes():
+        """
+        return the modification times of the source files of all scopes
+        """
+        finder = hook.PyshImportHook()
+        mtimes = {}
+        for scope in ['local', 'user', 'global']:
+            pyshdir = finder.find_pysh_scope("pysh.scopes." + scope)
+            for submodule in ['commands', 'config']:
+                path = os.path.join(pyshdir, submodule + '.py')
+                try:
+                    mtimes[path] = os.stat(path).st_mtime_ns
+                except OSError:
+                    mtimes[path] = None
+        return mtimes
+
+    def serve(self):
+        """
+        accept and run commands until a scope changes or we are interrupted
+
+        returns True iff the server stopped because a scope changed
+        """
+        stale = False
+        socket_dir = os.path.dirname(self.path)
+        try:
+            os.makedirs(socket_dir, mode=0o700)
+        except FileExistsError:
+            pass
+        if not client.is_private_dir(socket_dir):
+            raise PermissionError(
+                "Socket directory is not ours alone, not serving",
+                socket_dir)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self.path)
+            listener.listen()
+            while True:
+                connection, _address = listener.accept()
+                with connection:
+                    if not self.handle(connection):
+                        stale = True
+                        break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        return stale
+
+    def handle(self, connection):
+        """
+        run the command sent over a connection
+
+        returns False if the server is stale and should stop
+        """
+        if not client.is_trusted_peer(connection):
+            return True
+        message, fds = client.receive_message(connection, max_fds=3)
+        channels = dict(
+            zip(['stdin', 'stdout', 'stderr'], [
+                os.fdopen(fd, mode)
+                for fd, mode in zip(fds, ['r', 'w', 'w'])
+            ]))
+        try:
+            if message is None or len(channels) != 3:
+                return True
+            if self.get_scope_mtimes() != self.mtimes:
+                client.send_message(connection, {'stale': True})
+                return False
+            exit_code = self.run(message['command'], message['env'],
+                                 channels)
+            client.send_message(connection, {'exit_code': exit_code})
+            return True
+        finally:
+            for channel in channels.values():
+                channel.close()
+
+    def run(self, command, env, channels):
+        """
+        run a command with the client's environment and channels
+        """
+        os.environ.clear()
+        os.environ.update(env)
+        with process_channels(channels):
+            try:
+                call = getattr(self.chain, command[0])(*command[1:])
+                exit_code = call(**channels)
+            except SystemExit as exc:
+                exit_code = exc.code
+            except Exception:  # pylint: disable=broad-except
+                traceback.print_exc(file=channels['stderr'])
+                exit_code = 1
+            for channel in channels.values():
+                channel.flush()
+        return FunctionCommand.exit_status(exit_code)
+
+
+@contextlib.contextmanager
+def process_channels(channels):
+    """
+    point this process's stdout and stderr at the client's channels
+
+    Both the fds, which subprocesses in the middle of pipes inherit, and
+    sys.stdout and sys.stderr, which functions write to by default, are
+    swapped and restored after
+    """
+    saved = {}
+    for channel_name, fd in [('stdout', 1), ('stderr', 2)]:
+        getattr(sys, channel_name).flush()
+        saved[channel_name] = getattr(sys, channel_name), os.dup(fd)
+        os.dup2(channels[channel_name].fileno(), fd)
+        setattr(sys, channel_name, channels[channel_name])
+    try:
+        yield
+    finally:
+        for channel_name, fd in [('stdout', 1), ('stderr', 2)]:
+            channels[channel_name].flush()
+            sys_channel, saved_fd = saved[channel_name]
+            setattr(sys, channel_name, sys_channel)
+            os.dup2(saved_fd, fd)
+            os.close(saved_fd)
+
+
+def serve():
+    """
+    run a pysh server for the current directory
+
+    The server restarts itself to pick up changes to scopes
+    """
+    sys.meta_path.insert(0, hook.PyshImportHook())
+    if Server().serve():
+        os.execv(sys.executable, [sys.executable, "-m", "pysh", "--serve"])
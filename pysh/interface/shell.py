@@ -2,12 +2,21 @@
 main interface for pysh: core tools for running pysh commands
 """
 
+import contextvars
 import enum
-import importlib
+import itertools
 import os
+import shutil
 import subprocess
+import sys
+import threading
+import time
 
-from pysh.interface.command import ProcessCommand
+from concurrent import futures
+
+from pysh.interface import manifest, profiling, stream
+from pysh.interface.command import (FunctionChain, FunctionCommand,
+                                    ProcessCommand, getcwd)
 
 STANDARD_SEARCH_PATH = ":".join([
     "pysh.scopes.local.commands",
@@ -18,6 +27,9 @@ STANDARD_SEARCH_PATH = ":".join([
 
 SEARCH_PATH = os.environ.get("PYSHPATH", STANDARD_SEARCH_PATH)
 
+# redirect stderr to wherever stdout goes, like 2>&1
+STDOUT = subprocess.STDOUT
+
 # TODO think of a better way to suppress CommandCall output
 DELETE_STRING = "--DELETE NEXT 348ty1[29yavi--"
 
@@ -30,6 +42,8 @@ class CommandCall(object):
     def __init__(self, command=None, commands=None):
         self.command = command
         self.commands = commands if commands else [command]
+        self.stages = self.commands
+        self.profile = None
         self.status = None
 
     def __or__(self, other):
@@ -37,61 +51,344 @@ class CommandCall(object):
         right_commands = other.commands
         return PipingCall(left_commands + right_commands)
 
-    def __gt__(self, filename):
-        return FunnelCall(self, filename)
+    def __gt__(self, outfile):
+        return FunnelCall(self, stdout=outfile)
+
+    def __rshift__(self, outfile):
+        return FunnelCall(self, stdout=outfile, append=True)
+
+    def __lt__(self, infile):
+        return FunnelCall(self, stdin=infile)
 
     def __call__(self, wait=True, **channels):
         if self.status is not None:
             return
         self.status = 'called'
-        return self.command(wait=wait, **channels)
+        if self.profile is not None:
+            self.profile.begin()
+        exit_code = self.command(wait=wait, **channels)
+        if wait and self.profile is not None:
+            self.profile.finish()
+        return exit_code
 
     def __iter__(self):
-        self(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        yield self.to_str(self.command.stdout.read())
-        yield self.to_str(self.command.stderr.read())
+        return iter(self.communicate())
 
     def __repr__(self):
         self()
         return DELETE_STRING
 
-    def wait(self):
+    @property
+    def tail(self):
         """
-        wait for command to finish
+        the command whose output is the output of this call
         """
-        return self.command.wait()
+        return self.command
 
-    @staticmethod
-    def to_str(str_or_byte):
+    def tee(self, *branches):
+        """
+        return a call copying the output of this one to each of branches
+        as well as to its own stdout
+
+        see TeeCommand
+        """
+        tee_command = TeeCommand(branches)
+        tee_command.working_dir = getattr(self.tail, 'working_dir', None)
+        return self | CommandCall(tee_command)
+
+    def redirect(self, stdin=None, stdout=None, stderr=None, append=False):
+        """
+        return the call with its channels redirected to or from files
+
+        see FunnelCall
+        """
+        return FunnelCall(self, stdin, stdout, stderr, append)
+
+    def profiled(self):
+        """
+        record a profile of every stage of the call when it is run
+
+        Returns the call itself. Once the call has been waited on its
+        profile attribute holds the finished profiling.CallProfile
+        """
+        self.profile = profiling.CallProfile(self.stages)
+        return self
+
+    def communicate(self, limit=None, on_chunk=None):
+        """
+        run the command and return its (stdout, stderr) as strs
+
+        Both outputs are read concurrently so that the command never
+        blocks on a full pipe. At most limit characters of each are kept
+        and on_chunk(channel_name, chunk) is called with every chunk read
         """
-        decode byte from utf-8 encoding
+        self(wait=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            outputs = stream.drain({
+                'stdout': self.tail.stdout,
+                'stderr': self.tail.stderr
+            }, limit, on_chunk)
+        finally:
+            self.wait()
+        return outputs['stdout'], outputs['stderr']
+
+    def chunks(self, size=stream.CHUNK_SIZE):
         """
-        if isinstance(str_or_byte, str):
-            return str_or_byte
-        return str_or_byte.decode("utf-8")
+        run the command, lazily yielding chunks of its stdout as strs
 
+        The command blocks while chunks are not being consumed and gets a
+        broken pipe if the generator is closed before the output ends
+        """
+        self(wait=False, stdout=subprocess.PIPE)
+        try:
+            yield from stream.read_chunks(self.tail.stdout, size)
+        finally:
+            self.tail.stdout.close()
+            self.wait()
 
-# TODO should subclass CommandCall
-class FunnelCall(object):
+    def lines(self):
+        """
+        run the command, lazily yielding the lines of its stdout
+
+        Lines are yielded without their trailing newline
+        """
+        chunks = self.chunks()
+        try:
+            for batch in stream.split_chunks(chunks):
+                yield from batch
+        finally:
+            chunks.close()
+
+    def wait(self, timeout=None):
+        """
+        wait for command to finish
+        """
+        exit_code = self.command.wait(timeout)
+        if self.profile is not None:
+            self.profile.finish()
+        return exit_code
+
+
+class FunnelCall(CommandCall):
     """
-    A command whose output is written to a file
+    A call whose channels are redirected to or from files
+
+    stdin, stdout and stderr are each a path, an open file or None to
+    leave the channel alone, and stderr may be STDOUT to go wherever
+    stdout goes. stdout and stderr paths are truncated unless append is
+    set. Processes are handed the files themselves, so what they read and
+    write never passes through python. Redirections apply to the call as
+    a whole, so chain them with parentheses, e.g. (call < "in") > "out".
     """
 
-    def __init__(self, command_call, outfile):
+    def __init__(self, command_call, stdin=None, stdout=None, stderr=None,
+                 append=False):
+        super().__init__(commands=command_call.commands)
         self.command_call = command_call
-        self.outfile = outfile
+        self.stages = command_call.stages
+        self.redirects = {
+            channel_name: target
+            for channel_name, target in [('stdin', stdin), (
+                'stdout', stdout), ('stderr', stderr)] if target is not None
+        }
+        self.append = append
+        self.opened = []
 
-    def __call__(self, **kwargs):
-        with open(self.outfile, 'w') as f:
-            kwargs['stdout'] = f
-            return self.command_call(**kwargs)
+    def __call__(self, wait=True, **channels):
+        if self.status is not None:
+            return
+        self.status = 'called'
+        mode = 'a' if self.append else 'w'
+        for channel_name, target in self.redirects.items():
+            if isinstance(target, (str, os.PathLike)):
+                target = open(
+                    self.resolve_path(channel_name, target),
+                    'r' if channel_name == 'stdin' else mode)
+                self.opened.append(target)
+            channels[channel_name] = target
+        try:
+            exit_code = self.command_call(wait=wait, **channels)
+        finally:
+            if wait:
+                self.close()
+        return exit_code
+
+    @property
+    def tail(self):
+        """
+        the command whose output is the output of this call
+        """
+        return self.command_call.tail
 
-    def __repr__(self):
-        self()
-        return DELETE_STRING
+    def resolve_path(self, channel_name, path):
+        """
+        return the path of a file to redirect a channel to or from,
+        relative paths being in the working directory of the command
+        reading or writing it
+        """
+        stage = self.commands[0] if channel_name == 'stdin' else self.tail
+        working_dir = getattr(stage, 'working_dir', None)
+        return os.path.join(getcwd(), working_dir or '', path)
+
+    def communicate(self, limit=None, on_chunk=None):
+        """
+        run the command and return its (stdout, stderr) as strs, see
+        CommandCall.communicate
+
+        Redirected channels aren't read and come back as ''
+        """
+        piped = [
+            channel_name for channel_name in ['stdout', 'stderr']
+            if channel_name not in self.redirects
+        ]
+        self(wait=False,
+             **{channel_name: subprocess.PIPE
+                for channel_name in piped})
+        outputs = {}
+        try:
+            if piped:
+                outputs = stream.drain({
+                    channel_name: getattr(self.tail, channel_name)
+                    for channel_name in piped
+                }, limit, on_chunk)
+        finally:
+            self.wait()
+        return outputs.get('stdout', ''), outputs.get('stderr', '')
+
+    def profiled(self):
+        """
+        record a profile of the redirected call, see CommandCall.profiled
+        """
+        self.command_call.profiled()
+        self.profile = self.command_call.profile
+        return self
+
+    def wait(self, timeout=None):
+        """
+        wait for the redirected call to finish, closing any files opened
+        """
+        exit_code = self.command_call.wait(timeout)
+        self.close()
+        return exit_code
+
+    def close(self):
+        """
+        close the files opened for the redirected call
+        """
+        for opened in self.opened:
+            opened.close()
+        self.opened = []
+
+
+def fan_out(buffer):
+    """
+    copy each chunk of stdin to stdout and to buffer
+    """
+    try:
+        chunk = yield None
+        while chunk is not None:
+            buffer.write(chunk)
+            chunk = yield chunk, True
+    finally:
+        buffer.close()
+
+
+fan_out.is_binary = True
+
+
+class TeeCommand(FunctionCommand):
+    """
+    A command copying its stdin to its stdout and to each of its branches
+
+    Branches are calls, run with the stream as their stdin, or paths or
+    files to write it to. Every branch reads the same chunks from one
+    stream.SharedBuffer: calls starting with a function read it in that
+    function's own thread, without a pipe, and processes and files are
+    written to by a thread each. A branch capacity chunks behind the
+    others holds the tee, and everything before it, back until it catches
+    up. Branches write their output wherever they were redirected to, or
+    else to the shell's stdout and stderr. Like tee, the tee stops if
+    whatever reads its stdout goes away, ending the branches' input.
+    """
+
+    def __init__(self, branches, capacity=stream.TEE_CHUNKS):
+        self.buffer = stream.SharedBuffer(capacity)
+        super().__init__(fan_out, self.buffer)
+        self.branches = [
+            branch() if isinstance(branch, PartialCall) else branch
+            for branch in branches
+        ]
+        self.calls = []
+        self.feeders = []
+
+    def __call__(self, wait=True, **channels):
+        for branch in self.branches:
+            self.start_branch(branch)
+        return super().__call__(wait, **channels)
+
+    @property
+    def name(self):
+        """
+        the name of the command
+        """
+        return "tee"
+
+    def start_branch(self, branch):
+        """
+        start a branch reading from the buffer
+        """
+        reader = self.buffer.reader()
+        if not hasattr(branch, 'stages'):
+            if isinstance(branch, (str, os.PathLike)):
+                branch = os.path.join(getcwd(), self.working_dir or '', branch)
+                self.start_feeder(reader, open(branch, 'wb'))
+            else:
+                self.start_feeder(reader, stream.binary_channel(branch),
+                                  close=False)
+            return
+        self.calls.append(branch)
+        first = branch.stages[0]
+        if isinstance(first, FunctionCommand):
+            first.close_on_exit.append(reader)
+            branch(wait=False, stdin=reader)
+            return
+        branch(wait=False, stdin=subprocess.PIPE)
+        self.start_feeder(reader, first.stdin)
+
+    def start_feeder(self, reader, channel, close=True):
+        """
+        start a thread writing what reader reads to channel
+        """
+        feeder = threading.Thread(
+            target=stream.feed, args=(reader, channel, close))
+        feeder.start()
+        self.feeders.append(feeder)
+
+    def wait(self, timeout=None):
+        """
+        wait for the tee and its branches to finish, returning the tee's
+        exit code
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            """
+            return the time left until the deadline
+            """
+            if deadline is None:
+                return None
+            return max(0, deadline - time.monotonic())
+
+        exit_code = super().wait(timeout)
+        for feeder in self.feeders:
+            feeder.join(remaining())
+            if feeder.is_alive():
+                raise subprocess.TimeoutExpired(self.name, timeout)
+        for call in self.calls:
+            call.wait(remaining())
+        return exit_code
 
 
-# TODO should be able to generalize to arbitrary IO redirection
 class PipingCall(CommandCall):
     """
     A CommandCall which pipes output from one command into another
@@ -99,36 +396,249 @@ class PipingCall(CommandCall):
 
     def __init__(self, commands):
         super().__init__(commands=commands)
+        self.stages = self.fuse(commands)
+
+    @staticmethod
+    def fuse(commands):
+        """
+        return the commands to run, with runs of FunctionCommands fused into
+        FunctionChains which pass python objects between functions directly
+
+        Binary FunctionCommands pass bytes rather than lines so are never
+        fused
+        """
+        stages = []
+        groups = itertools.groupby(
+            commands, lambda command: isinstance(command, FunctionCommand) and
+            not command.binary)
+        for is_function, group in groups:
+            group = list(group)
+            if is_function and len(group) > 1:
+                stages.append(FunctionChain(group))
+            else:
+                stages.extend(group)
+        return stages
 
     def __call__(self, wait=True, **channels):
-        first, *middle, last = self.commands
-        first_channels = {'stdout': subprocess.PIPE}
+        first_channels = {}
         if 'stdin' in channels:
             first_channels['stdin'] = channels['stdin']
             del channels['stdin']
-        first(wait=False, **first_channels)
-        previous_command = first
-        for command in middle:
-            command(
-                wait=False,
-                stdin=previous_command.stdout,
-                stdout=subprocess.PIPE)
-            previous_command = command
-        last(wait=False, stdin=previous_command.stdout, **channels)
+        if self.profile is not None:
+            self.profile.begin()
+        *init, last = self.stages
+        for stage, next_stage in zip(init, self.stages[1:]):
+            stage(wait=False, stdout=subprocess.PIPE, **first_channels)
+            first_channels = {'stdin': stage.stdout}
+            if isinstance(next_stage, FunctionCommand):
+                next_stage.close_on_exit.append(stage.stdout)
+        last(wait=False, **dict(first_channels, **channels))
+        self.release_links()
         if wait:
-            self.wait()
+            return self.wait()
 
-    def wait(self):
+    def release_links(self):
+        """
+        close the pipes between stages that subprocesses now hold
+
+        Only the stages at either end may hold a pipe open so that a
+        writer sees a broken pipe as soon as its reader goes away.
+        FunctionCommands close the pipes they read from once they exit.
+        """
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            if isinstance(next_stage, FunctionCommand):
+                continue
+            stage.stdout.close()
+
+    def wait(self, timeout=None):
         """
-        wait for subcommands to finish
+        wait for subcommands to finish, returning the last one's exit code
         """
+        deadline = None if timeout is None else time.monotonic() + timeout
         for command in self.commands:
-            command.wait()
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            exit_code = command.wait(timeout)
+        if self.profile is not None:
+            self.profile.finish()
+        return exit_code
+
+    @property
+    def tail(self):
+        """
+        the last stage of the pipe
+        """
+        return self.stages[-1]
+
+
+class MappingCall(object):
+    """
+    Runs the CommandCall made by a factory for each of many arguments,
+    at most max_workers at a time
+
+    Iterating yields (argument, exit_code, stdout, stderr) tuples in the
+    order the calls finish. Tuple arguments are unpacked into the factory.
+    """
+
+    def __init__(self, command_factory, arguments, max_workers=None,
+                 limit=None):
+        self.command_factory = command_factory
+        self.arguments = arguments
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.limit = limit
+        self.results = []
+        self.status = None
 
     def __iter__(self):
-        self(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        yield self.to_str(self.commands[-1].stdout.read())
-        yield self.to_str(self.commands[-1].stderr.read())
+        if self.status is not None:
+            yield from self.results
+            return
+        self.status = 'called'
+        arguments = iter(self.arguments)
+        pending = set()
+        with futures.ThreadPoolExecutor(self.max_workers) as pool:
+            while True:
+                for argument in itertools.islice(
+                        arguments, self.max_workers - len(pending)):
+                    # calls see the working directory of the caller
+                    context = contextvars.copy_context()
+                    pending.add(pool.submit(context.run, self.run, argument))
+                if not pending:
+                    break
+                done, pending = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    self.results.append(result)
+                    yield result
+
+    def __repr__(self):
+        for _argument, _exit_code, out, err in self:
+            sys.stdout.write(out)
+            sys.stderr.write(err)
+        return DELETE_STRING
+
+    def run(self, argument):
+        """
+        run the call for one argument and return its result tuple
+        """
+        args = argument if isinstance(argument, tuple) else (argument, )
+        call = self.command_factory(*args)
+        out, err = call.communicate(self.limit)
+        return argument, call.wait(), out, err
+
+    def wait(self):
+        """
+        run every call, returning 0 if all of them succeeded or else the
+        exit code of the first one to fail
+        """
+        for _result in self:
+            pass
+        return self.exit_code
+
+    @property
+    def exit_code(self):
+        """
+        the aggregate exit code of the calls finished so far
+        """
+        for _argument, exit_code, _out, _err in self.results:
+            if exit_code:
+                return exit_code
+        return 0
+
+
+class CommandTable(object):
+    """
+    A hashed table of command factories, like bash's hash builtin
+
+    Names are resolved once to an attribute of a search object or to the
+    absolute path of an executable on $PATH. Executable entries are
+    dropped when $PATH or the modification time of one of its
+    directories changes, checked at most once every check_interval
+    seconds. Search object entries last until rehash is called.
+    """
+
+    def __init__(self, search_objs, check_interval=1.0):
+        self.search_objs = search_objs
+        self.check_interval = check_interval
+        self.factories = {}
+        self.executables = set()
+        self.path_state = None
+        self.checked_at = None
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, cmd_name):
+        """
+        return the command factory for cmd_name
+        """
+        self.check_path()
+        command_factory = self.factories.get(cmd_name)
+        if command_factory is not None:
+            self.hits += 1
+            return command_factory
+        self.misses += 1
+        for search_obj in self.search_objs:
+            if hasattr(search_obj, cmd_name):
+                command_factory = getattr(search_obj, cmd_name)
+                self.factories[cmd_name] = command_factory
+                return command_factory
+        executable = shutil.which(cmd_name)
+        if executable is None or not os.path.isabs(executable):
+            # let Popen report missing commands and resolve relative paths
+            return ProcessCommand.from_proc_name(cmd_name)
+        command_factory = ProcessCommand.from_proc_name(cmd_name, executable)
+        self.factories[cmd_name] = command_factory
+        self.executables.add(cmd_name)
+        return command_factory
+
+    def check_path(self):
+        """
+        forget executables if $PATH or its directories have changed
+        """
+        now = time.monotonic()
+        if (self.checked_at is not None and
+                now - self.checked_at < self.check_interval):
+            return
+        self.checked_at = now
+        path_state = self.get_path_state()
+        if path_state != self.path_state:
+            for cmd_name in self.executables:
+                del self.factories[cmd_name]
+            self.executables.clear()
+            self.path_state = path_state
+
+    @staticmethod
+    def get_path_state():
+        """
+        return $PATH along with the modification times of its directories
+        """
+        path = os.environ.get("PATH", os.defpath)
+        mtimes = []
+        for directory in path.split(os.pathsep):
+            try:
+                mtimes.append(os.stat(directory or os.curdir).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return path, tuple(mtimes)
+
+    def rehash(self):
+        """
+        forget every resolved command
+        """
+        self.factories.clear()
+        self.executables.clear()
+        self.checked_at = None
+
+    def stats(self):
+        """
+        return the number of cached commands, hits and misses
+        """
+        return {
+            'commands': len(self.factories),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
 
 
 class ExecutionMode(enum.Enum):
@@ -147,14 +657,18 @@ class PartialCall(object):
     A call which has not yet been given arguments
     """
 
+    command_call = CommandCall
+
     def __init__(self, command_factory, working_dir):
         # TODO proper wrapping of command_factory
         self.command_factory = command_factory
         self.working_dir = working_dir
 
     def __call__(self, *args, **kwargs):
-        os.chdir(self.working_dir)
-        return CommandCall(self.command_factory(*args, **kwargs))
+        command = self.command_factory(*args, **kwargs)
+        if isinstance(command, (FunctionCommand, ProcessCommand)):
+            command.working_dir = self.working_dir
+        return self.command_call(command)
 
     def __repr__(self):
         return repr(self())
@@ -168,12 +682,27 @@ class PartialCall(object):
     def __gt__(self, outfile):
         return self() > outfile
 
+    def __rshift__(self, outfile):
+        return self() >> outfile
+
+    def __lt__(self, infile):
+        return self() < infile
+
+    def tee(self, *branches):
+        """
+        return a call copying the output of this one to each of branches,
+        see CommandCall.tee
+        """
+        return self().tee(*branches)
+
 
 class Shell(object):
     """
     A means to calling pysh commands
     """
 
+    partial_call = PartialCall
+
     def __init__(self,
                  working_dir='.',
                  search_path=SEARCH_PATH,
@@ -182,6 +711,8 @@ class Shell(object):
             raise NotImplementedError(
                 "Non on-read execution mode not implemented")
         self.search_objs = self.get_search_objs(search_path)
+        self.command_table = CommandTable(self.search_objs)
+        self.command_index = manifest.CommandIndex(self.search_objs)
         self.working_dir = working_dir
 
     def cd(self, new_dir):
@@ -190,6 +721,15 @@ class Shell(object):
         """
         self.working_dir = new_dir
 
+    @staticmethod
+    def map(command_factory, arguments, max_workers=None, limit=None):
+        """
+        run command_factory(argument) for each argument concurrently
+
+        see MappingCall
+        """
+        return MappingCall(command_factory, arguments, max_workers, limit)
+
     def export(self, **kwargs):
         """
         export a variable to any subcommands
@@ -200,21 +740,22 @@ class Shell(object):
     def get_search_objs(search_path):
         """
         return a list of objects in which to search for subcommands
+
+        Scope modules are only imported once a command is found in them
         """
         if not search_path:
             return []
         return [
-            importlib.import_module(module)
-            for module in search_path.split(":")
+            manifest.LazyScope(module) for module in search_path.split(":")
         ]
 
     def __getattr__(self, cmd_name):
-        for search_obj in self.search_objs:
-            if hasattr(search_obj, cmd_name):
-                command_factory = getattr(search_obj, cmd_name)
-                return PartialCall(command_factory, self.working_dir)
-        return PartialCall(
-            ProcessCommand.from_proc_name(cmd_name), self.working_dir)
+        command_factory = self.command_table.lookup(cmd_name)
+        return self.partial_call(command_factory, self.working_dir)
+
+    def __dir__(self):
+        return sorted(
+            set(super().__dir__()) | set(self.command_index.get_entries()))
 
 
 class FallbackChain(object):
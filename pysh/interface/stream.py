@@ -0,0 +1,575 @@
+"""
+Stream: block-buffered reading and writing of line-oriented channels
+"""
+
+import codecs
+import collections
+import contextlib
+import errno
+import functools
+import io
+import os
+import stat
+import threading
+
+CHUNK_SIZE = 64 * 1024
+FLUSH_SIZE = 64 * 1024
+BATCH_LINES = 4096
+FLUSH_DELAY = 0.01
+TRANSFER_SIZE = 1024 * 1024
+TEE_CHUNKS = 64
+
+
+def read_chunks(channel, chunk_size=CHUNK_SIZE):
+    """
+    yield decoded str chunks from a channel until it is exhausted
+
+    Reads whatever is available (up to chunk_size) rather than blocking
+    until a full chunk arrives so that interactive input still flows
+    """
+    raw = getattr(channel, 'buffer', channel)
+    read = getattr(raw, 'read1', raw.read)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+        if isinstance(chunk, str):
+            yield chunk
+        else:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def binary_channel(channel):
+    """
+    return the binary channel under a text channel, flushing any text
+    written to it first, a DecodingChannel for a text channel with none
+    under it or else the channel itself
+    """
+    raw = getattr(channel, 'buffer', None)
+    if raw is None:
+        if isinstance(channel, io.TextIOBase):
+            return DecodingChannel(channel)
+        return channel
+    channel.flush()
+    return raw
+
+
+class DecodingChannel(object):
+    """
+    A binary channel writing to a text channel with no binary channel
+    under it, like an io.StringIO, by decoding what is written as utf-8
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def write(self, data):
+        """
+        decode data and write the text to the channel
+        """
+        text = self.decoder.decode(data)
+        if text:
+            self.channel.write(text)
+        return memoryview(data).nbytes
+
+    def flush(self):
+        """
+        flush the channel
+        """
+        flush = getattr(self.channel, 'flush', None)
+        if flush is not None:
+            flush()
+
+
+def transfer(src, dst):
+    """
+    copy the rest of the file src to dst, returning the number of bytes
+    copied
+
+    When both are backed by fds the kernel moves the data, with sendfile
+    from regular files and splice from pipes, so it is never read into
+    python
+    """
+    dst.flush()
+    try:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+    except (AttributeError, OSError, ValueError):
+        return copy_chunks(src, dst)
+    mode = os.fstat(src_fd).st_mode
+    if stat.S_ISREG(mode) and hasattr(os, 'sendfile'):
+        move = functools.partial(os.sendfile, dst_fd, src_fd, None)
+    elif stat.S_ISFIFO(mode) and hasattr(os, 'splice'):
+        move = functools.partial(os.splice, src_fd, dst_fd)
+    else:
+        return copy_chunks(src, dst)
+    total = 0
+    while True:
+        try:
+            moved = move(TRANSFER_SIZE)
+        except OSError as exc:
+            # some fds, like those of files opened to append, can't be used
+            if total == 0 and exc.errno in (errno.EINVAL, errno.ENOSYS):
+                return copy_chunks(src, dst)
+            raise
+        if not moved:
+            return total
+        total += moved
+
+
+def copy_chunks(src, dst):
+    """
+    copy the rest of the file src to dst through python, returning the
+    number of bytes copied
+    """
+    total = 0
+    for chunk in iter(lambda: src.read(TRANSFER_SIZE), b''):
+        dst.write(chunk)
+        total += len(chunk)
+    return total
+
+
+def split_lines(lines):
+    """
+    split any lines containing newlines into separate lines
+
+    returns lines itself when there is nothing to split
+    """
+    joined = "\n".join(lines)
+    if joined.count("\n") == len(lines) - 1:
+        return lines
+    return joined.split("\n")
+
+
+def split_chunks(chunks):
+    """
+    yield lists of the complete lines in an iterable of str chunks
+
+    Lines are yielded without their trailing newline
+    """
+    partial = ''
+    for chunk in chunks:
+        lines = (partial + chunk).split("\n")
+        partial = lines.pop()
+        if lines:
+            yield lines
+    if partial:
+        yield [partial]
+
+
+class LineReader(object):
+    """
+    Reads a channel in large chunks and splits it into lines in bulk
+    """
+
+    def __init__(self, channel, chunk_size=CHUNK_SIZE):
+        self.batches = split_chunks(read_chunks(channel, chunk_size))
+
+    def readbatch(self):
+        """
+        return the next list of complete lines or None if the channel is done
+        """
+        return next(self.batches, None)
+
+
+class DelayedFlushing(object):
+    """
+    Mixin for writers which, given a flush_delay, flush themselves that
+    many seconds after being written to unless flushed before then
+
+    Output is then never held back for long by a writer whose function
+    has gone on to block or to run slowly. Writing and flushing are
+    serialized by the writer's lock as the delayed flush happens in
+    another thread.
+    """
+
+    def init_flushing(self, flush_delay):
+        """
+        set up delayed flushing, never flushing late if flush_delay is None
+        """
+        self.flush_delay = flush_delay
+        self.lock = threading.RLock()
+        self.timer = None
+
+    def schedule_flush(self):
+        """
+        flush in flush_delay seconds unless flushed before then
+        """
+        if self.flush_delay is None or self.timer is not None:
+            return
+        self.timer = threading.Timer(self.flush_delay, self.flush_late)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def cancel_flush(self):
+        """
+        forget any scheduled flush, the writer being flushed now
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def flush_late(self):
+        """
+        flush from the timer, the channel maybe being closed already
+        """
+        with contextlib.suppress(BrokenPipeError, ValueError):
+            self.flush()
+
+
+class LineWriter(DelayedFlushing):
+    """
+    Buffers lines written to a channel and writes them out in batches
+    """
+
+    def __init__(self, channel, end="\n", flush_size=FLUSH_SIZE,
+                 flush_delay=None):
+        self.channel = channel
+        self.end = end
+        self.flush_size = flush_size
+        self.buffer = []
+        self.size = 0
+        self.init_flushing(flush_delay)
+
+    def write_lines(self, lines):
+        """
+        buffer lines, flushing if enough data has accumulated
+        """
+        if not lines:
+            return
+        if len(lines) == 1:
+            text = lines[0] + self.end
+        else:
+            text = self.end.join(lines) + self.end
+        with self.lock:
+            self.buffer.append(text)
+            self.size += len(text)
+            if self.size >= self.flush_size:
+                self.flush()
+            elif self.timer is None:
+                self.schedule_flush()
+
+    def write(self, text):
+        """
+        buffer raw text
+        """
+        with self.lock:
+            self.buffer.append(text)
+            self.size += len(text)
+            self.schedule_flush()
+
+    def flush(self):
+        """
+        write all buffered data to the channel
+        """
+        with self.lock:
+            self.cancel_flush()
+            if self.buffer:
+                self.channel.write("".join(self.buffer))
+                self.buffer = []
+                self.size = 0
+            flush = getattr(self.channel, 'flush', None)
+            if flush is not None:
+                flush()
+
+
+class ChunkReader(object):
+    """
+    Reads a channel in chunks of bytes, without decoding them
+    """
+
+    def __init__(self, channel, chunk_size=CHUNK_SIZE):
+        self.channel = channel
+        self.chunk_size = chunk_size
+
+    def readbatch(self):
+        """
+        return a list of the next chunk read or None if the channel is done
+
+        Chunks are whatever is available, up to chunk_size bytes
+        """
+        raw = getattr(self.channel, 'buffer', self.channel)
+        chunk = getattr(raw, 'read1', raw.read)(self.chunk_size)
+        if not chunk:
+            return None
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        return [chunk]
+
+
+class ChunkWriter(DelayedFlushing):
+    """
+    Writes bytes-like chunks to a binary channel as they are
+
+    Chunks may also be files opened for reading, whose contents are
+    transferred to the channel before they are closed
+    """
+
+    def __init__(self, channel, flush_delay=None):
+        self.channel = channel
+        self.init_flushing(flush_delay)
+
+    def write_lines(self, chunks):
+        """
+        write chunks, standing in for LineWriter.write_lines
+        """
+        with self.lock:
+            for chunk in chunks:
+                if not hasattr(chunk, 'read'):
+                    self.channel.write(chunk)
+                    continue
+                with chunk:
+                    getattr(self.channel, 'transfer', self.transfer)(chunk)
+            self.schedule_flush()
+
+    def transfer(self, src):
+        """
+        copy the rest of the file src to the channel
+        """
+        return transfer(src, self.channel)
+
+    def flush(self):
+        """
+        flush the channel
+        """
+        with self.lock:
+            self.cancel_flush()
+            flush = getattr(self.channel, 'flush', None)
+            if flush is not None:
+                flush()
+
+
+class SharedBuffer(object):
+    """
+    A bounded window of chunks written once and read by many readers
+
+    Every reader has its own place in the window and a chunk is dropped
+    once all of them have read it. Writing blocks while the window is full,
+    so the slowest reader holds the writer back instead of the window
+    growing without bound. Readers share the chunks written, which are
+    never copied.
+    """
+
+    def __init__(self, capacity=TEE_CHUNKS):
+        self.capacity = capacity
+        self.chunks = collections.deque()
+        # the index of chunks[0] in everything written
+        self.first = 0
+        self.positions = {}
+        self.closed = False
+        self.condition = threading.Condition()
+
+    @property
+    def end(self):
+        """
+        the index of the next chunk to be written
+        """
+        return self.first + len(self.chunks)
+
+    def reader(self):
+        """
+        return a new BufferReader starting at the oldest chunk in the window
+        """
+        reader = BufferReader(self)
+        with self.condition:
+            self.positions[reader] = self.first
+        return reader
+
+    def write(self, chunk):
+        """
+        add a chunk to the window, waiting for room if it is full
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: len(self.chunks) < self.capacity)
+            self.chunks.append(chunk)
+            self.trim()
+
+    def close(self):
+        """
+        mark the end of the chunks, letting readers finish
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def next_chunk(self, reader):
+        """
+        return the next chunk for reader, waiting for one to be written, or
+        b'' once they are all read
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.positions[reader] < self.end or self.closed)
+            position = self.positions[reader]
+            if position == self.end:
+                return b''
+            chunk = self.chunks[position - self.first]
+            self.positions[reader] = position + 1
+            self.trim()
+            return chunk
+
+    def detach(self, reader):
+        """
+        stop keeping chunks for reader
+        """
+        with self.condition:
+            self.positions.pop(reader, None)
+            self.trim()
+
+    def trim(self):
+        """
+        drop the chunks every reader has read and wake up anyone waiting
+        """
+        oldest = min(self.positions.values(), default=self.end)
+        while self.first < oldest:
+            self.chunks.popleft()
+            self.first += 1
+        self.condition.notify_all()
+
+
+class BufferReader(object):
+    """
+    A binary channel reading the chunks of a SharedBuffer
+
+    Closing the reader detaches it from the buffer, so a reader which
+    stops early does not hold back the writer
+    """
+
+    def __init__(self, shared):
+        # not named buffer, which would make it look like a text channel
+        self.shared = shared
+        self.rest = b''
+        self.closed = False
+
+    def read1(self, size=-1):
+        """
+        return at most size bytes, waiting only if none are left over from
+        the last chunk read
+        """
+        if self.closed:
+            raise ValueError("read from closed BufferReader")
+        if not self.rest:
+            self.rest = self.shared.next_chunk(self)
+        if size is None or size < 0 or size >= len(self.rest):
+            data, self.rest = self.rest, b''
+        else:
+            data, self.rest = self.rest[:size], self.rest[size:]
+        return data
+
+    def read(self, size=-1):
+        """
+        return at most size bytes, or all the rest if size is negative
+        """
+        if size is not None and size >= 0:
+            return self.read1(size)
+        return b''.join(iter(self.read1, b''))
+
+    def readable(self):
+        """
+        return True, the reader being readable
+        """
+        return True
+
+    def close(self):
+        """
+        detach the reader from its buffer
+        """
+        if not self.closed:
+            self.closed = True
+            self.shared.detach(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.close()
+
+
+def feed(reader, channel, close=True):
+    """
+    write the chunks of a BufferReader to a binary channel until they are
+    done or the channel is closed by its reader
+
+    The reader is closed after and the channel too, unless close is False
+    """
+    try:
+        with reader:
+            for chunk in iter(reader.read1, b''):
+                channel.write(chunk)
+    except BrokenPipeError:
+        pass
+    finally:
+        with contextlib.suppress(BrokenPipeError):
+            if close:
+                channel.close()
+            else:
+                channel.flush()
+
+
+def drain(channels, limit=None, on_chunk=None):
+    """
+    read a dict of channels to exhaustion concurrently, closing them
+
+    returns a dict of the strs read from each channel, keeping at most
+    limit characters of each. on_chunk(channel_name, chunk) is called
+    (from one thread at a time) with every chunk as it is read
+
+    If reading a channel fails, e.g. on output that isn't UTF-8, the rest
+    of it is still read and thrown away so that whatever writes to it
+    never blocks on a full pipe. Once every channel is done the first
+    error is raised
+    """
+    lock = threading.Lock()
+    outputs = {}
+    errors = []
+
+    def read(channel_name):
+        """
+        read one channel into outputs
+        """
+        channel = channels[channel_name]
+        kept = []
+        size = 0
+        try:
+            for chunk in read_chunks(channel):
+                if on_chunk is not None:
+                    with lock:
+                        on_chunk(channel_name, chunk)
+                if limit is not None and size >= limit:
+                    continue
+                if limit is not None:
+                    chunk = chunk[:limit - size]
+                kept.append(chunk)
+                size += len(chunk)
+        except Exception as exc:  # pylint: disable=broad-except
+            errors.append(exc)
+            raw = getattr(channel, 'buffer', channel)
+            with contextlib.suppress(Exception):
+                while raw.read(CHUNK_SIZE):
+                    pass
+        finally:
+            channel.close()
+        outputs[channel_name] = "".join(kept)
+
+    first, *others = sorted(channels)
+    threads = [
+        threading.Thread(target=read, args=(channel_name, ))
+        for channel_name in others
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        read(first)
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return outputs
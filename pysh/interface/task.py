@@ -0,0 +1,305 @@
+"""
+Task: pysh commands which form a dependency graph, like make targets
+
+    @pyshtask(inputs=["setup.py"], outputs=["venv/bin/python"])
+    def mkvenv():
+        return SH.python3("-m", "venv", "venv")
+
+    @pyshtask(depends=[mkvenv], inputs=["**/*.py"])
+    def build():
+        ...
+
+Running a task runs its dependencies first, as many at a time as the
+graph allows, skipping tasks whose inputs have not changed since they last
+succeeded.
+"""
+
+import contextvars
+import functools
+import glob
+import json
+import os
+import time
+
+from concurrent import futures
+
+from pysh.interface import cache
+from pysh.interface.command import FunctionCommand, ProcessCommand, getcwd
+
+
+def default_state_path():
+    """
+    return the path of the file recording when tasks last succeeded
+    """
+    return os.path.join(os.path.dirname(cache.default_cache_dir()),
+                        "tasks.json")
+
+
+class TaskFailure(Exception):
+    """
+    raised when a task fails
+    """
+    pass
+
+
+class Task(object):
+    """
+    A command which depends on other tasks and on input files
+
+    A task is up to date, and skipped, when none of its dependencies were
+    run, its code and the contents of its inputs are as they were when it
+    last succeeded and all its outputs exist. Tasks without inputs always
+    run.
+    """
+
+    def __init__(self, function, depends=(), inputs=(), outputs=()):
+        functools.update_wrapper(self, function)
+        self.function = function
+        self.depends = list(depends)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.is_pysh_command = True
+
+    def __call__(self, max_workers=None):
+        return FunctionCommand(run_tasks, [self], TaskRunner(max_workers))
+
+    def __repr__(self):
+        return "<Task {}>".format(self.__name__)
+
+    def graph(self):
+        """
+        return this task and every task it depends on, dependencies first
+        """
+        ordered = []
+        visiting = set()
+
+        def visit(task):
+            """
+            add task after its dependencies
+            """
+            if task in ordered:
+                return
+            if task in visiting:
+                raise ValueError("Tasks depend on each other", task)
+            visiting.add(task)
+            for dependency in task.depends:
+                visit(dependency)
+            visiting.remove(task)
+            ordered.append(task)
+
+        visit(self)
+        return ordered
+
+    def key(self, working_dir):
+        """
+        return a hash of the task's code and inputs or None if it has none
+        """
+        if not self.inputs:
+            return None
+        return cache.command_key(self.function, (), {}, working_dir, (),
+                                 self.inputs)
+
+    def outputs_exist(self, working_dir):
+        """
+        return True iff every output of the task exists
+        """
+        return all(
+            glob.glob(os.path.join(working_dir, output), recursive=True)
+            for output in self.outputs)
+
+    def run(self):
+        """
+        run the task's function, raising TaskFailure if it fails
+        """
+        result = self.function()
+        if isinstance(result, (FunctionCommand, ProcessCommand)):
+            result = result()
+        elif callable(getattr(result, 'wait', None)):
+            result()
+            result = result.wait()
+        exit_code = FunctionCommand.exit_status(result)
+        if exit_code:
+            raise TaskFailure(self.__name__, exit_code)
+
+
+def pyshtask(depends=(), inputs=(), outputs=()):
+    """
+    decorator making a function into a pysh task
+
+    depends lists the tasks to run first and inputs and outputs are glob
+    patterns relative to the working directory. The function may return
+    an exit code or a command to run.
+    """
+
+    def decorator(function):
+        """
+        make function into a Task
+        """
+        return Task(function, depends, inputs, outputs)
+
+    return decorator
+
+
+class TaskRunner(object):
+    """
+    Runs a graph of tasks, at most max_workers at a time
+
+    Records the keys of the tasks which last succeeded in the json file at
+    state_path. After a run, durations and errors hold how long each task
+    run took and what made each failed one fail
+    """
+
+    def __init__(self, max_workers=None, state_path=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.state_path = state_path or default_state_path()
+        self.durations = {}
+        self.errors = {}
+
+    def read_state(self):
+        """
+        return the recorded keys of tasks which last succeeded
+        """
+        try:
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+
+    def write_state(self, state):
+        """
+        record the keys of tasks which last succeeded
+        """
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = "{}.{}".format(self.state_path, os.getpid())
+        with open(tmp_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(tmp_path, self.state_path)
+
+    @staticmethod
+    def state_name(task, working_dir):
+        """
+        return the name under which a task's state is recorded
+        """
+        return "{}:{}.{}".format(working_dir, task.__module__,
+                                 task.__qualname__)
+
+    def run(self, targets):
+        """
+        run the target tasks and their dependencies
+
+        yields (task, status) as each task finishes, status being one of
+        'ran', 'skipped', 'failed' or 'cancelled'
+        """
+        working_dir = getcwd()
+        tasks = []
+        for target in targets:
+            tasks.extend(task for task in target.graph() if task not in tasks)
+        state = self.read_state()
+        statuses = {}
+        pending = {}
+        with futures.ThreadPoolExecutor(self.max_workers) as pool:
+            while len(statuses) < len(tasks):
+                for task in tasks:
+                    if task in statuses or task in pending.values():
+                        continue
+                    depends = [statuses.get(dep) for dep in task.depends]
+                    if None in depends:
+                        continue
+                    if any(status in ['failed', 'cancelled']
+                           for status in depends):
+                        statuses[task] = 'cancelled'
+                        yield task, 'cancelled'
+                        continue
+                    name = self.state_name(task, working_dir)
+                    key = task.key(working_dir)
+                    if (key is not None and 'ran' not in depends and
+                            state.get(name) == key and
+                            task.outputs_exist(working_dir)):
+                        statuses[task] = 'skipped'
+                        yield task, 'skipped'
+                        continue
+                    # tasks see the working directory of the runner
+                    context = contextvars.copy_context()
+                    pending[pool.submit(context.run, self.time_task,
+                                        task)] = task
+                if not pending:
+                    continue
+                done, _not_done = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    task = pending.pop(future)
+                    name = self.state_name(task, working_dir)
+                    try:
+                        future.result()
+                    except Exception as exc:  # pylint: disable=broad-except
+                        statuses[task] = 'failed'
+                        self.errors[task] = exc
+                        state.pop(name, None)
+                    else:
+                        statuses[task] = 'ran'
+                        key = task.key(working_dir)
+                        if key is not None:
+                            state[name] = key
+                    yield task, statuses[task]
+        self.write_state(state)
+
+    def time_task(self, task):
+        """
+        run a task, recording how long it took
+        """
+        start = time.monotonic()
+        try:
+            task.run()
+        finally:
+            self.durations[task] = time.monotonic() - start
+
+    def critical_path(self):
+        """
+        return the chain of tasks which took the longest to run in total
+        and that total, in seconds
+        """
+        longest = {}
+
+        def path_to(task):
+            """
+            return the longest (duration, chain) ending in task
+            """
+            if task not in longest:
+                duration = self.durations.get(task, 0.0)
+                chains = [path_to(dep) for dep in task.depends]
+                total, chain = max(chains, key=lambda path: path[0],
+                                   default=(0.0, []))
+                longest[task] = (total + duration, chain + [task])
+            return longest[task]
+
+        if not self.durations:
+            return [], 0.0
+        total, chain = max(
+            (path_to(task) for task in self.durations),
+            key=lambda path: path[0])
+        return chain, total
+
+
+def run_tasks(targets, runner):
+    """
+    run tasks, yielding a line as each finishes and a report of the
+    critical path at the end
+    """
+    for task, status in runner.run(targets):
+        if status == 'ran':
+            yield "{}: ran in {:.2f}s".format(task.__name__,
+                                             runner.durations[task])
+        elif status == 'failed':
+            yield "stderr", "{}: failed: {!r}".format(task.__name__,
+                                                      runner.errors[task])
+        else:
+            yield "{}: {}".format(task.__name__, status)
+    chain, total = runner.critical_path()
+    if chain:
+        steps = [
+            "{} ({:.2f}s)".format(task.__name__,
+                                  runner.durations.get(task, 0.0))
+            for task in chain
+        ]
+        yield "critical path: {} = {:.2f}s".format(" -> ".join(steps), total)
+    return 1 if runner.errors else 0
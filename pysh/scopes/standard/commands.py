@@ -3,7 +3,6 @@ Commands accessible from any pysh project
 """
 
 import os
-import functools
 
 from pysh.interface.command import FunctionCommand, pyshcommand
 from pysh.interface.shell import Shell
@@ -58,22 +57,12 @@ def cmds():
     """
     List existing pysh commands
     """
-    for module in SH.search_objs:
-        getmodattr = functools.partial(getattr, module)
-        all_attrs = dict(zip(dir(module), map(getmodattr, dir(module))))
-        cmd_attrs = {
-            attrname: attr
-            for attrname, attr in all_attrs.items()
-            if getattr(attr, 'is_pysh_command', False) is True
-        }
-
-        if not cmd_attrs:
+    for scope_name, commands in SH.command_index.scopes():
+        if not commands:
             continue
         yield ''
-        yield _readable_description(module.__name__)
-        yield "=" * len(module.__name__)
-        for command_name in sorted(cmd_attrs):
-            docstr_parts = cmd_attrs[command_name].__doc__.split("\n")
-            docstr = docstr_parts[0] if docstr_parts[0] or not\
-                     (len(docstr_parts) > 1) else docstr_parts[1]
-            yield "{}: {}".format(command_name, docstr)
+        yield _readable_description(scope_name)
+        yield "=" * len(scope_name)
+        for command_name in sorted(commands):
+            yield "{}:     {}".format(command_name,
+                                      commands[command_name]['doc'])
@@ -0,0 +1,52 @@
+"""
+Test the benchmark suite
+"""
+
+import os
+import tempfile
+import unittest
+
+from pysh.benchmarks import suite
+
+
+class SuiteWorks(unittest.TestCase):
+    """
+    Test that benchmarks run and their results compare
+    """
+
+    def test_pipeline_benchmarks(self):
+        """
+        Test timing pysh and bash pipelines over a small input
+        """
+        benchmarks = suite.Suite(input_size=4096, repeat=1)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.txt")
+            suite.write_input(input_path, benchmarks.input_size)
+            records = [
+                benchmarks.grep_throughput(input_path),
+                benchmarks.pipeline(input_path, 3)
+            ]
+        self.assertEqual([record['name'] for record in records],
+                         ["grep_throughput", "pipeline_depth_3"])
+        for record in records:
+            self.assertGreater(record['pysh'], 0)
+            self.assertGreater(record['bash'], 0)
+
+    def test_compare(self):
+        """
+        Test finding benchmarks which got slower
+        """
+        previous = {
+            'input_size': 1,
+            'results': [{'name': 'a', 'pysh': 1.0},
+                        {'name': 'b', 'pysh': 1.0}]
+        }
+        current = {
+            'input_size': 1,
+            'results': [{'name': 'a', 'pysh': 1.05},
+                        {'name': 'b', 'pysh': 2.0},
+                        {'name': 'c', 'pysh': 9.0}]
+        }
+        self.assertEqual(suite.compare(previous, current), [('b', 1.0, 2.0)])
+        current['input_size'] = 2
+        self.assertEqual(suite.compare(previous, current), [])
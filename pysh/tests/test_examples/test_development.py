@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import types
+import unittest
+
+try:
+    import nose  # pylint: disable=unused-import
+except ImportError:
+    # development only uses nose.tools.nottest, a no-op for these tests
+    nose_tools = types.ModuleType("nose.tools")
+    nose_tools.nottest = lambda function: function
+    sys.modules["nose"] = types.ModuleType("nose")
+    sys.modules["nose"].tools = nose_tools
+    sys.modules["nose.tools"] = nose_tools
+
+# pylint: disable=wrong-import-position
+from pysh.examples import development
+from pysh.interface import command, shell
+
+# prints the paths it is given, exiting with one less than their number
+ECHO_PATHS = [
+    '-c', 'import sys; print(" ".join(sys.argv[1:])); '
+    'sys.exit(len(sys.argv) - 2)'
+]
+
+# also appends the path it is given to the log file named by $CHECK_LOG
+LOG_PATH = [
+    '-c', 'import os, sys; print(sys.argv[1]); '
+    'open(os.environ["CHECK_LOG"], "a").write(sys.argv[1] + "\\n")'
+]
+
+
+class DevelopmentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pkg_path = os.path.join(self.tmp_dir.name, "pkg")
+        for name in ["a.py", "b.py", "sub/__init__.py", "sub/c.py",
+                     "data/d.txt"]:
+            path = os.path.join(self.pkg_path, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as module_file:
+                module_file.write("# {}\n".format(name))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.pkg_path, name)
+
+
+class ShardingWorks(DevelopmentTestCase):
+    def test_find_shards(self):
+        shards = development.find_shards([self.pkg_path, self.path("a.py")])
+        assert shards == [
+            (self.path("a.py"), self.path("b.py")),
+            (self.path("sub"), ),
+            (self.path("a.py"), ),
+        ]
+
+    def test_check_shards(self):
+        results = development.check_shards(ECHO_PATHS, [("a", ),
+                                                        ("b", "c")])
+        assert results == [(0, "a\n", ""), (1, "b c\n", "")]
+
+    def test_merge_html(self):
+        reports = [
+            "<html><body class='x'>\nfirst\n</body></html>",
+            "<html><BODY>second</BODY></html>",
+        ]
+        merged = development.merge_html(reports)
+        assert merged == "<html><body>\n\nfirst\n\nsecond\n</body></html>\n"
+        assert development.merge_html(reports[:1]) == reports[0]
+
+
+class GatingWorks(DevelopmentTestCase):
+    def test_run_gates(self):
+        def passing():
+            pass
+
+        def failing():
+            raise development.TestFailure("lint errors")
+
+        unit_call = shell.Shell(search_path='').python3('-c', 'print("unit")')
+        call = shell.CommandCall(
+            command.FunctionCommand(development.run_gates, unit_call,
+                                    [passing, failing]))
+        out, err = call
+        assert out == "unit\npassing: passed\n"
+        assert err == "failing: lint errors\n"
+        assert call.wait() == 1
+
+    def test_gates_pass(self):
+        unit_call = shell.Shell(search_path='').python3('-c', 'pass')
+        call = shell.CommandCall(
+            command.FunctionCommand(development.run_gates, unit_call,
+                                    [lambda: None]))
+        out, _err = call
+        assert out == "<lambda>: passed\n"
+        assert call.wait() == 0
+
+    def test_gates_see_working_dir(self):
+        gate_dirs = []
+
+        def pwd():
+            gate_dirs.append(command.getcwd())
+
+        unit_call = shell.Shell(search_path='').python3('-c', 'pass')
+        call = shell.PartialCall(
+            command.FunctionCommand.from_generator(development.run_gates),
+            self.pkg_path)(unit_call, [pwd])
+        call.wait()
+        assert gate_dirs == [self.pkg_path]
+
+
+class CheckingChangedWorks(DevelopmentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.results_path = os.path.join(self.tmp_dir.name, "results.json")
+        self.log_path = os.path.join(self.tmp_dir.name, "log.txt")
+        os.environ["CHECK_LOG"] = self.log_path
+
+    def tearDown(self):
+        del os.environ["CHECK_LOG"]
+        super().tearDown()
+
+    def check(self, args=None):
+        if os.path.exists(self.log_path):
+            os.unlink(self.log_path)
+        results = development.check_changed(args or LOG_PATH,
+                                            [self.pkg_path],
+                                            self.results_path, 'mtime')
+        if not os.path.exists(self.log_path):
+            return results, []
+        with open(self.log_path) as log_file:
+            return results, log_file.read().split()
+
+    def test_file_keys(self):
+        paths = [self.path("a.py"), self.path("b.py")]
+        keys = development.file_keys(paths, 'git')
+        with open(paths[0], 'rb') as module_file:
+            data = module_file.read()
+        blob = b"blob " + str(len(data)).encode() + b"\0" + data
+        assert keys[paths[0]] == hashlib.sha1(blob).hexdigest()
+        assert keys[paths[0]] != keys[paths[1]]
+        before = development.file_keys(paths, 'mtime')
+        with open(paths[0], 'a') as module_file:
+            module_file.write("changed = True\n")
+        after = development.file_keys(paths, 'mtime')
+        assert before[paths[0]] != after[paths[0]]
+        assert before[paths[1]] == after[paths[1]]
+        with self.assertRaises(ValueError):
+            development.file_keys(paths, 'ctime')
+
+    def test_only_changed_rechecked(self):
+        modules = [self.path(name) for name in
+                   ["a.py", "b.py", "sub/__init__.py", "sub/c.py"]]
+        results, checked = self.check()
+        assert sorted(checked) == modules
+        assert results == [(0, path + "\n", "") for path in modules]
+        with open(self.path("b.py"), 'a') as module_file:
+            module_file.write("changed = True\n")
+        merged, checked = self.check()
+        assert checked == [self.path("b.py")]
+        assert merged == results
+
+    def test_stale_entries_pruned(self):
+        self.check()
+        os.unlink(self.path("sub/c.py"))
+        results, checked = self.check()
+        assert checked == []
+        assert len(results) == 3
+        with open(self.results_path) as results_file:
+            stored = json.load(results_file)
+        assert sorted(stored['files']) == [
+            self.path(name) for name in ["a.py", "b.py", "sub/__init__.py"]
+        ]
+
+    def test_new_args_recheck_all(self):
+        self.check()
+        _results, checked = self.check(
+            [LOG_PATH[0], LOG_PATH[1] + "  # changed"])
+        assert len(checked) == 4
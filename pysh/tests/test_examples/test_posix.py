@@ -1,7 +1,10 @@
 import io
+import os
+import tempfile
 import unittest
 
 from pysh.examples import posix
+from pysh.interface import shell
 
 
 class PosixTestCase(unittest.TestCase):
@@ -14,3 +17,111 @@ class GrepWorks(PosixTestCase):
         stdout = io.StringIO()
         posix.grep("Wo")(stdin=stdin, stdout=stdout)
         assert stdout.getvalue() == "World!\n"
+
+    def test_regex_and_several_expressions(self):
+        stdin = io.StringIO("Hello\nWorld!\nwhat\n")
+        stdout = io.StringIO()
+        posix.grep(["^W", "l+o$"])(stdin=stdin, stdout=stdout)
+        assert stdout.getvalue() == "Hello\nWorld!\n"
+
+    def test_complement(self):
+        stdin = io.StringIO("Hello\nWorld!\nwhat\n")
+        stdout = io.StringIO()
+        posix.grep("o", True)(stdin=stdin, stdout=stdout)
+        assert stdout.getvalue() == "what\n"
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, name) for name in ["a", "b"]]
+            for path, text in zip(paths, ["Hello\nWorld!\n", "Wombat"]):
+                with open(path, 'w') as src_file:
+                    src_file.write(text)
+            stdout = io.StringIO()
+            stderr = io.StringIO()
+            exit_code = posix.grep("Wo", False, *paths)(stdout=stdout,
+                                                         stderr=stderr)
+            assert exit_code == 0
+            assert stdout.getvalue() == "{}:World!\n{}:Wombat\n".format(
+                *paths)
+            stdout = io.StringIO()
+            exit_code = posix.grep("Wo", False, paths[0], "missing")(
+                stdout=stdout, stderr=stderr)
+            assert exit_code == 2
+            assert "missing" in stderr.getvalue()
+
+    def test_blocks_in_parallel(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "a")
+            with open(path, 'w') as src_file:
+                src_file.write("".join("{}\n".format(i) for i in range(100)))
+            blocks = [(path, begin, end)
+                      for begin, end in posix.file_blocks(path, 16)]
+            assert len(blocks) > 2
+            results = posix.scan_in_parallel("7", False, blocks, 2)
+            lines = [line for block in results for line in block]
+            assert lines == [str(i) for i in range(100) if "7" in str(i)]
+
+
+class CoreutilsWork(PosixTestCase):
+    def run_command(self, command, text):
+        stdout = io.StringIO()
+        command(stdin=io.StringIO(text), stdout=stdout)
+        return stdout.getvalue()
+
+    def test_cat_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "a")
+            with open(path, 'w') as src_file:
+                src_file.write("Hello\nWorld!\n")
+            stdout = io.StringIO()
+            posix.cat(path, path)(stdout=stdout)
+            assert stdout.getvalue() == "Hello\nWorld!\n" * 2
+            stdout = io.BytesIO()
+            posix.cat(path)(stdout=stdout)
+            assert stdout.getvalue() == b"Hello\nWorld!\n"
+
+    def test_head_stops_upstream(self):
+        sh = shell.Shell(search_path="pysh.examples.posix")
+        out, _err = shell.Shell(search_path="").yes() | sh.head(2)
+        assert out == "y\ny\n"
+
+    def test_head_and_tail(self):
+        text = "".join("{}\n".format(i) for i in range(10000))
+        assert self.run_command(posix.head(2), text) == "0\n1\n"
+        assert self.run_command(posix.tail(2), text) == "9998\n9999\n"
+
+    def test_wc(self):
+        text = "Hello World!\nfoo\n"
+        assert self.run_command(posix.wc(), text) == "2 3 17\n"
+        assert self.run_command(posix.wc(True), text) == "2\n"
+
+    def test_cut(self):
+        text = "a:b:c:d\nno fields\n"
+        assert self.run_command(posix.cut("3-,1", ":"),
+                                text) == "a:c:d\nno fields\n"
+
+    def test_uniq(self):
+        text = "a\na\nb\na\n"
+        assert self.run_command(posix.uniq(), text) == "a\nb\na\n"
+        assert self.run_command(posix.uniq(True),
+                                text) == "      2 a\n      1 b\n      1 a\n"
+
+    def test_sort(self):
+        lines = ["{}".format((i * 7919) % 1000) for i in range(1000)]
+        text = "\n".join(lines) + "\n"
+        assert self.run_command(posix.sort(),
+                                text) == "\n".join(sorted(lines)) + "\n"
+        expected = "\n".join(sorted(lines, key=int, reverse=True)) + "\n"
+        # a small buffer makes sort spill runs to disk
+        assert self.run_command(posix.sort(True, True, 1000),
+                                text) == expected
+
+    def test_merging_many_runs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [
+                posix.write_run([str(i), str(i + 5)], tmp_dir)
+                for i in range(5)
+            ]
+            merged = posix.merge_runs(paths, int, False, tmp_dir, width=2)
+            assert list(merged) == [str(i) for i in range(10)]
+            assert os.listdir(tmp_dir) == []
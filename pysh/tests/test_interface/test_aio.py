@@ -0,0 +1,109 @@
+"""
+Test running commands with asyncio
+"""
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+from pysh.interface import aio
+
+
+class AsyncShellTestCase(unittest.TestCase):
+    """
+    Abstract base class for an asyncio shell test case
+    """
+
+    def setUp(self):
+        test_dir = os.path.dirname(__file__)
+        self.shell = aio.AsyncShell(test_dir, "pysh.examples.posix")
+
+    @staticmethod
+    def run_async(coroutine):
+        """
+        run a coroutine to completion on a new event loop
+        """
+        return asyncio.run(coroutine)
+
+
+class AwaitingWorks(AsyncShellTestCase):
+    """
+    Test awaiting the output of commands
+    """
+
+    def test_await_function(self):
+        """
+        test awaiting the output of a FunctionCommand
+        """
+        out, _err = self.run_async(self.await_call(self.shell.echo("Hi")))
+        self.assertEqual(out, "Hi\n")
+
+    def test_await_mixed_pipe(self):
+        """
+        test awaiting a pipe of functions and subprocs
+        """
+        pipe = (self.shell.echo("Hello\nWorld!") | self.shell.grep("o") |
+                self.shell.cat() | self.shell.grep("W"))
+        out, _err = self.run_async(self.await_call(pipe))
+        self.assertEqual(out, "World!\n")
+
+    def test_output_kept_as_is(self):
+        """
+        test that output without a trailing newline comes back unchanged
+        """
+        call = self.shell.sh("-c", "printf no-newline; printf err >&2")
+        self.assertEqual(
+            self.run_async(self.await_call(call)), ("no-newline", "err"))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "a")
+            with open(path, 'w') as src_file:
+                src_file.write("no-newline")
+            out, _err = self.run_async(self.await_call(self.shell.cat(path)))
+        self.assertEqual(out, "no-newline")
+
+    def test_many_concurrent_pipes(self):
+        """
+        test running many pipes on one event loop
+        """
+
+        async def run_all():
+            """
+            gather the outputs of many pipes
+            """
+            calls = [
+                self.shell.cat("example_file.txt") | self.shell.grep("Hell")
+                for _ in range(20)
+            ]
+            return await asyncio.gather(*calls)
+
+        outputs = self.run_async(run_all())
+        self.assertEqual(outputs, [("Hell\nHello\n", "")] * 20)
+
+    @staticmethod
+    async def await_call(call):
+        """
+        await an AsyncCommandCall
+        """
+        return await call
+
+
+class AsyncIteratingWorks(AsyncShellTestCase):
+    """
+    Test iterating over the output of commands with async for
+    """
+
+    def test_lines_of_pipe(self):
+        """
+        test reading lines from a subproc piped into a function
+        """
+
+        async def collect():
+            """
+            collect the lines of a pipe
+            """
+            pipe = self.shell.cat("example_file.txt") | self.shell.grep("He")
+            return [line async for line in pipe]
+
+        self.assertEqual(
+            self.run_async(collect()), ["He", "Hel", "Hell", "Hello"])
@@ -0,0 +1,283 @@
+"""
+Test running commands directly
+"""
+
+import hashlib
+import io
+import os
+import select
+import subprocess
+import tempfile
+import threading
+import unittest
+
+from pysh.interface import cache, command
+
+
+class FunctionCommandTestCase(unittest.TestCase):
+    """
+    Abstract base class for FunctionCommand test cases
+    """
+
+    @staticmethod
+    def run_function(function, *args, **channels):
+        """
+        run a generator function as a FunctionCommand with StringIO channels
+        """
+        channels.setdefault('stdin', io.StringIO())
+        channels.setdefault('stdout', io.StringIO())
+        channels.setdefault('stderr', io.StringIO())
+        function_cmd = command.FunctionCommand(function, *args)
+        exit_code = function_cmd(**channels)
+        return function_cmd, exit_code
+
+
+class WaitingWorks(FunctionCommandTestCase):
+    """
+    Test waiting for a FunctionCommand to finish
+    """
+
+    def test_exit_code_is_return_value(self):
+        """
+        test that the value returned by the generator is the exit code
+        """
+
+        def fail_with(code):
+            yield "failing"
+            return code
+
+        _cmd, exit_code = self.run_function(fail_with, 3)
+        self.assertEqual(exit_code, 3)
+
+    def test_exception_gives_failure(self):
+        """
+        test that an exception in the generator gives exit code 1
+        """
+
+        def broken():
+            yield "about to break"
+            raise KeyError("broken")
+
+        stderr = io.StringIO()
+        function_cmd, exit_code = self.run_function(broken, stderr=stderr)
+        self.assertEqual(exit_code, 1)
+        self.assertIsInstance(function_cmd.exception, KeyError)
+        self.assertIn("KeyError", stderr.getvalue())
+
+    def test_wait_times_out(self):
+        """
+        test that waiting on a blocked command times out
+        """
+        release = threading.Event()
+
+        def blocked():
+            release.wait()
+            yield "released"
+
+        function_cmd = command.FunctionCommand(blocked)
+        function_cmd(wait=False, stdout=io.StringIO())
+        with self.assertRaises(subprocess.TimeoutExpired):
+            function_cmd.wait(timeout=0.01)
+        release.set()
+        self.assertEqual(function_cmd.wait(timeout=5), 0)
+
+
+class FlushingWorks(FunctionCommandTestCase):
+    """
+    Test that output is written while the function is still running
+    """
+
+    def test_output_not_held_back(self):
+        """
+        test that a line is written before the function goes on to block
+        """
+        release = threading.Event()
+
+        def slow():
+            yield "first"
+            release.wait()
+            yield "second"
+
+        read_fd, write_fd = os.pipe()
+        with os.fdopen(read_fd) as read_end, \
+                os.fdopen(write_fd, 'w') as write_end:
+            function_cmd = command.FunctionCommand(slow)
+            function_cmd(wait=False, stdout=write_end)
+            readable, _, _ = select.select([read_end], [], [], 1)
+            release.set()
+            self.assertEqual(readable, [read_end])
+            self.assertEqual(read_end.readline(), "first\n")
+            self.assertEqual(read_end.readline(), "second\n")
+            self.assertEqual(function_cmd.wait(timeout=5), 0)
+
+
+class BatchingWorks(FunctionCommandTestCase):
+    """
+    Test functions using the batch protocol
+    """
+
+    def test_batches_received_and_yielded(self):
+        """
+        test that a batched function gets and yields lists of lines
+        """
+
+        def upper():
+            lines = yield None
+            while lines is not None:
+                lines = yield [line.upper() for line in lines], True
+
+        upper.is_batched = True
+        stdout = io.StringIO()
+        self.run_function(
+            upper, stdin=io.StringIO("Hello\nWorld!"), stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "HELLO\nWORLD!\n")
+
+
+class BinaryWorks(FunctionCommandTestCase):
+    """
+    Test functions reading and writing bytes
+    """
+
+    @staticmethod
+    def noise():
+        """
+        yield every byte value, many times over
+        """
+        chunk = bytes(range(256)) * 64
+        for _ in range(64):
+            yield memoryview(chunk)
+
+    @staticmethod
+    def digest():
+        """
+        yield the sha256 hex digest of stdin
+        """
+        hashed = hashlib.sha256()
+        chunk = yield None
+        while chunk is not None:
+            hashed.update(chunk)
+            chunk = yield None
+        yield hashed.hexdigest().encode() + b"\n"
+
+    def test_bytes_passed_unchanged(self):
+        """
+        test that bytes which are not text pass through a function as they
+        are
+        """
+
+        def swap_case():
+            chunk = yield None
+            while chunk is not None:
+                chunk = yield chunk.swapcase(), True
+
+        swap_case.is_binary = True
+        data = bytes(range(256)) + b"\r\n\n"
+        stdout = io.BytesIO()
+        self.run_function(
+            swap_case, stdin=io.BytesIO(data), stdout=stdout)
+        self.assertEqual(stdout.getvalue(), data.swapcase())
+
+    def test_bytes_piped_through_process(self):
+        """
+        test piping bytes from a function through a process to a function
+        """
+        from pysh.interface import shell
+        noise = command.FunctionCommand.from_bytes_generator(self.noise)
+        digest = command.FunctionCommand.from_bytes_generator(self.digest)
+        call = (shell.CommandCall(noise()) |
+                shell.CommandCall(command.ProcessCommand("cat")) |
+                shell.CommandCall(digest()))
+        out, _err = call.profiled()
+        expected = hashlib.sha256(bytes(range(256)) * 64 * 64).hexdigest()
+        self.assertEqual(out, expected + "\n")
+        noise_profile = call.profile.report()['stages'][0]
+        self.assertEqual(noise_profile['bytes_out'], 256 * 64 * 64)
+        self.assertIsNone(noise_profile['lines_out'])
+
+
+class CachingWorks(FunctionCommandTestCase):
+    """
+    Test replaying the output of cached commands
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = cache.OutputCache(os.path.join(self.tmpdir.name, "c"))
+        self.input_path = os.path.join(self.tmpdir.name, "input.txt")
+        self.runs = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_cached(self, cmd, *args):
+        """
+        run a cached command in the temporary dir, returning its outputs
+        """
+        cached_cmd = command.cachedcommand(
+            inputs=["*.txt"], store=self.store)(cmd)(*args)
+        cached_cmd.working_dir = self.tmpdir.name
+        stdout, stderr = io.StringIO(), io.StringIO()
+        exit_code = cached_cmd(stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue(), exit_code
+
+    def count_lines(self, path):
+        """
+        a FunctionCommand factory recording each time it is run
+        """
+
+        def counter():
+            self.runs.append(path)
+            with open(command.resolve_path(path)) as counted:
+                yield "{} lines".format(len(counted.readlines()))
+            yield "stderr", "counted"
+            return 3
+
+        return command.FunctionCommand(counter)
+
+    def test_output_replayed(self):
+        """
+        test that a command is run once and its outputs replayed after
+        """
+        with open(self.input_path, 'w') as input_file:
+            input_file.write("Hello\n")
+        first = self.run_cached(self.count_lines, "input.txt")
+        second = self.run_cached(self.count_lines, "input.txt")
+        self.assertEqual(first, ("1 lines\n", "counted\n", 3))
+        self.assertEqual(second, first)
+        self.assertEqual(self.runs, ["input.txt"])
+
+    def test_changed_input_reruns(self):
+        """
+        test that changing an input file runs the command again
+        """
+        for contents in ["Hello\n", "Hello\nWorld!\n"]:
+            with open(self.input_path, 'w') as input_file:
+                input_file.write(contents)
+            out, _err, _exit_code = self.run_cached(self.count_lines,
+                                                    "input.txt")
+        self.assertEqual(out, "2 lines\n")
+        self.assertEqual(len(self.runs), 2)
+
+    def test_process_cached(self):
+        """
+        test that the outputs of subprocesses are cached
+        """
+        echo = command.ProcessCommand.from_proc_name("echo")
+        self.assertEqual(
+            self.run_cached(echo, "Hello"), ("Hello\n", "", 0))
+        self.assertEqual(
+            self.run_cached(echo, "Hello"), ("Hello\n", "", 0))
+        self.assertEqual(len(os.listdir(self.store.path)), 1)
+
+    def test_least_recently_used_evicted(self):
+        """
+        test that the store evicts the least recently used outputs
+        """
+        self.store.put("old", {'stdout': "x" * 100})
+        self.store.put("new", {'stdout': "x" * 100})
+        os.utime(self.store.entry_path("old"), (0, 0))
+        self.store.max_size = 150
+        self.store.get("new")
+        self.store.evict()
+        self.assertIsNone(self.store.get("old"))
+        self.assertIsNotNone(self.store.get("new"))
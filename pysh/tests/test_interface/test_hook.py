@@ -0,0 +1,101 @@
+"""
+Test importing pysh scopes
+"""
+
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+from pysh.interface import hook, shell
+
+
+class TemporaryScopeHook(hook.PyshImportHook):
+    """
+    An import hook finding every scope in the same directory
+    """
+
+    def __init__(self, pyshdir):
+        self.pyshdir = pyshdir
+
+    def find_pysh_scope(self, name):
+        return self.pyshdir
+
+
+class ScopeLoadingWorks(unittest.TestCase):
+    """
+    Test loading the submodules of a scope
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.src_path = os.path.join(self.tmpdir.name, "commands.py")
+        self.finder = TemporaryScopeHook(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_source(self, source):
+        """
+        write the source of the commands module, bumping its mtime
+        """
+        with open(self.src_path, 'w') as src_file:
+            src_file.write(source)
+        mtime = os.stat(self.src_path).st_mtime + 1
+        os.utime(self.src_path, (mtime, mtime))
+
+    def load(self, submodule):
+        """
+        load a submodule of the user scope with the hook
+        """
+        spec = self.finder.find_spec("pysh.scopes.user." + submodule, None)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def test_bytecode_cached(self):
+        """
+        test that loading a scope module writes and uses a .pyc cache
+        """
+        self.write_source("greeting = 'Hello'\n")
+        with unittest.mock.patch.object(sys, 'dont_write_bytecode', False):
+            module = self.load("commands")
+        self.assertEqual(module.greeting, 'Hello')
+        self.assertEqual(module.__file__, self.src_path)
+        cache_path = importlib.util.cache_from_source(self.src_path)
+        self.assertTrue(os.path.exists(cache_path))
+
+    def test_changed_source_recompiled(self):
+        """
+        test that a stale cache is not used after the source changes
+        """
+        self.write_source("greeting = 'Hello'\n")
+        self.load("commands")
+        self.write_source("greeting = 'Goodbye'\n")
+        self.assertEqual(self.load("commands").greeting, 'Goodbye')
+
+    def test_missing_submodule_empty(self):
+        """
+        test that a scope without a config.py gets an empty config module
+        """
+        module = self.load("config")
+        self.assertEqual(module.__name__, "pysh.scopes.user.config")
+        self.assertFalse(hasattr(module, 'COMMAND_OPTIONS'))
+
+
+class CompletionWorks(unittest.TestCase):
+    """
+    Test tab-completing names in interactive mode
+    """
+
+    def test_commands_completed(self):
+        """
+        test that pysh commands complete alongside python names
+        """
+        posix_shell = shell.Shell(search_path="pysh.examples.posix")
+        completer = hook.CommandCompleter({'grepped': 1},
+                                          posix_shell.command_index)
+        matches = [completer.complete("gre", state) for state in range(3)]
+        self.assertEqual(matches, ["grepped", "grep(", None])
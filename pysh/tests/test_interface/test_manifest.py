@@ -0,0 +1,123 @@
+"""
+Test looking up names in scopes through their manifests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+from pysh.interface import manifest
+
+MODULE_NAME = "pysh_manifest_test_scope"
+
+COMMANDS_SOURCE = '''
+from pysh.interface.command import pyshcommand
+
+
+@pyshcommand
+def greet(name='World'):
+    """
+    Greet someone
+
+    At length
+    """
+    return name
+
+
+def helper():
+    return None
+'''
+
+
+class LazyScopeWorks(unittest.TestCase):
+    """
+    Test that scopes are only imported when needed
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.src_path = os.path.join(self.tmpdir.name, MODULE_NAME + ".py")
+        sys.path.insert(0, self.tmpdir.name)
+
+    def tearDown(self):
+        sys.path.remove(self.tmpdir.name)
+        sys.modules.pop(MODULE_NAME, None)
+        self.tmpdir.cleanup()
+
+    def write_source(self, source):
+        """
+        write the source of the scope module, bumping its mtime
+        """
+        with open(self.src_path, 'w') as src_file:
+            src_file.write(source)
+        mtime = os.stat(self.src_path).st_mtime + 1
+        os.utime(self.src_path, (mtime, mtime))
+        sys.modules.pop(MODULE_NAME, None)
+
+    def test_missing_name_not_imported(self):
+        """
+        test that asking for a name a scope lacks does not import it
+        """
+        self.write_source("greeting = 'Hello'\n")
+        self.assertTrue(hasattr(manifest.LazyScope(MODULE_NAME), 'greeting'))
+        sys.modules.pop(MODULE_NAME)
+        scope = manifest.LazyScope(MODULE_NAME)
+        self.assertFalse(hasattr(scope, 'farewell'))
+        self.assertNotIn(MODULE_NAME, sys.modules)
+        self.assertEqual(scope.greeting, 'Hello')
+        self.assertIn(MODULE_NAME, sys.modules)
+
+    def test_stale_manifest_rebuilt(self):
+        """
+        test that names added to a scope's source are found
+        """
+        self.write_source("greeting = 'Hello'\n")
+        self.assertFalse(hasattr(manifest.LazyScope(MODULE_NAME), 'farewell'))
+        self.write_source("greeting = 'Hello'\nfarewell = 'Goodbye'\n")
+        scope = manifest.LazyScope(MODULE_NAME)
+        self.assertEqual(scope.farewell, 'Goodbye')
+
+
+class CommandIndexWorks(unittest.TestCase):
+    """
+    Test describing the commands of scopes
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        src_path = os.path.join(self.tmpdir.name, MODULE_NAME + ".py")
+        with open(src_path, 'w') as src_file:
+            src_file.write(COMMANDS_SOURCE)
+        sys.path.insert(0, self.tmpdir.name)
+        self.index = manifest.CommandIndex(
+            [manifest.LazyScope(MODULE_NAME)])
+
+    def tearDown(self):
+        sys.path.remove(self.tmpdir.name)
+        sys.modules.pop(MODULE_NAME, None)
+        self.tmpdir.cleanup()
+
+    def test_commands_described(self):
+        """
+        test that commands are described by scope, docstring and signature
+        """
+        self.assertEqual(
+            self.index.get("greet"), {
+                'name': "greet",
+                'scope': MODULE_NAME,
+                'doc': "Greet someone",
+                'signature': "(name='World')",
+            })
+        self.assertIsNone(self.index.get("helper"))
+
+    def test_described_without_import(self):
+        """
+        test that a scope with a manifest is described without importing it
+        """
+        self.index.get_entries()
+        sys.modules.pop(MODULE_NAME)
+        index = manifest.CommandIndex([manifest.LazyScope(MODULE_NAME)])
+        self.assertEqual(index.complete("gr"), ["greet"])
+        self.assertNotIn(MODULE_NAME, sys.modules)
+
@@ -0,0 +1,134 @@
+"""
+Test running commands on a pysh server
+"""
+
+import os
+import socket
+import tempfile
+import threading
+import types
+import unittest
+
+from unittest import mock
+
+from pysh.interface import client, server, shell
+
+
+class ServingWorks(unittest.TestCase):
+    """
+    Test handing commands to a server over a socket
+    """
+
+    def setUp(self):
+        self.server = server.Server("unused.sock", "pysh.examples.posix")
+        self.mtimes = self.server.mtimes
+        self.functions = shell.Shell(search_path="pysh.examples.posix")
+        self.processes = shell.Shell(search_path="")
+
+    def send_command(self, command):
+        """
+        send a command to the server, returning its reply, stdout and stderr
+        """
+        server_sock, client_sock = socket.socketpair()
+        out_read, out_write = os.pipe()
+        err_read, err_write = os.pipe()
+        handler = threading.Thread(
+            target=self.server.handle, args=(server_sock, ))
+        handler.start()
+        with client_sock:
+            client.send_message(client_sock, {
+                'command': command,
+                'env': dict(os.environ),
+            }, [0, out_write, err_write])
+            os.close(out_write)
+            os.close(err_write)
+            reply, _fds = client.receive_message(client_sock)
+        handler.join()
+        server_sock.close()
+        with os.fdopen(out_read) as stdout, os.fdopen(err_read) as stderr:
+            return reply, stdout.read(), stderr.read()
+
+    def test_command_run(self):
+        """
+        test that the command writes to the client's stdout
+        """
+        reply, out, _err = self.send_command(["echo", "Hello", "World!"])
+        self.assertEqual(reply, {'exit_code': 0})
+        self.assertEqual(out, "Hello World!\n")
+
+    def test_stale_server(self):
+        """
+        test that a server whose scopes changed refuses to run commands
+        """
+        self.server.mtimes = dict(self.mtimes, changed=0)
+        reply, out, _err = self.send_command(["echo", "Hello"])
+        self.assertEqual(reply, {'stale': True})
+        self.assertEqual(out, "")
+
+    def test_pipe_stderr_to_client(self):
+        """
+        test that every stage of a pipe writes stderr to the client's
+        """
+
+        def noisy():
+            """
+            return a pipe whose first stage writes to stderr
+            """
+            return (self.processes.sh("-c", "echo err >&2; echo out") |
+                    self.functions.cat())
+
+        self.server.chain = types.SimpleNamespace(noisy=noisy)
+        reply, out, err = self.send_command(["noisy"])
+        self.assertEqual(reply, {'exit_code': 0})
+        self.assertEqual((out, err), ("out\n", "err\n"))
+
+
+class SocketSecurityWorks(unittest.TestCase):
+    """
+    Test that clients and servers only talk through private directories
+    """
+
+    def test_private_dir(self):
+        """
+        test telling private directories from shared ones and links
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            private = os.path.join(tmp_dir, "private")
+            os.mkdir(private, 0o700)
+            shared = os.path.join(tmp_dir, "shared")
+            os.mkdir(shared)
+            os.chmod(shared, 0o755)
+            link = os.path.join(tmp_dir, "link")
+            os.symlink(private, link)
+            self.assertTrue(client.is_private_dir(private))
+            self.assertFalse(client.is_private_dir(shared))
+            self.assertFalse(client.is_private_dir(link))
+            self.assertFalse(
+                client.is_private_dir(os.path.join(tmp_dir, "missing")))
+
+    def test_no_request_through_shared_dir(self):
+        """
+        test that neither end uses a socket in a shared directory
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_dir = os.path.join(tmp_dir, "pysh-{}".format(os.getuid()))
+            os.mkdir(socket_dir)
+            os.chmod(socket_dir, 0o777)
+            path = os.path.join(socket_dir, "project.sock")
+            with socket.socket(socket.AF_UNIX) as listener:
+                listener.bind(path)
+                listener.listen()
+                with mock.patch.object(client, 'socket_path',
+                                       return_value=path):
+                    self.assertIsNone(client.request(["echo"]))
+            with self.assertRaises(PermissionError):
+                server.Server(path, "pysh.examples.posix").serve()
+
+    def test_peer_uid(self):
+        """
+        test that our own processes are trusted peers
+        """
+        first, second = socket.socketpair()
+        with first, second:
+            self.assertTrue(client.is_trusted_peer(first))
+            self.assertIn(client.peer_uid(first), [None, os.getuid()])
@@ -5,12 +5,20 @@ Test interaction with a Shell
 import functools
 import operator
 import os
+import signal
+import sys
+import tempfile
+import threading
 import unittest
 
-from pysh.interface import shell
+from pysh.interface import shell, stream
 from pysh.interface import command
 from pysh.examples import posix
 
+POSIX_COMMANDS = [
+    "grep", "echo", "cat", "head", "tail", "wc", "cut", "uniq", "sort"
+]
+
 
 class ShellTestCase(unittest.TestCase):
     """
@@ -22,13 +30,13 @@ class ShellTestCase(unittest.TestCase):
     def setUp(self):
         test_dir = os.path.dirname(__file__)
         self.shell = shell.Shell(test_dir, "pysh.examples.posix")
-        for cmd in ["grep", "echo"]:
+        for cmd in POSIX_COMMANDS:
             new_name = "posix_" + cmd
             setattr(posix, new_name, getattr(posix, cmd))
             delattr(posix, cmd)
 
     def tearDown(self):
-        for cmd in ["grep", "echo"]:
+        for cmd in POSIX_COMMANDS:
             new_name = "posix_" + cmd
             setattr(posix, cmd, getattr(posix, new_name))
             delattr(posix, new_name)
@@ -112,3 +120,448 @@ class PipingWorks(ShellTestCase):
                                      map(self.shell.grep, expressions),
                                      self.shell.cat("example_file.txt"))
         self.assertEqual(out, "Hello\n")
+
+    def test_reader_exit_stops_writer(self):
+        """
+        Test that a function stops once the subproc reading it exits
+        """
+
+        def yes():
+            while True:
+                yield "y"
+
+        yes_cmd = shell.CommandCall(command.FunctionCommand(yes))
+        out, _err = yes_cmd | self.shell.head("-n", "2")
+        self.assertEqual(out, "y\ny\n")
+
+    def test_functions_fused(self):
+        """
+        Test that piped functions are run as a single FunctionChain
+        """
+        echo, grep = self.shell.posix_echo, self.shell.posix_grep
+        pipe = echo("Hello\nWorld!\n") | grep("o") | grep("W")
+        self.assertEqual(len(pipe.stages), 1)
+        self.assertIsInstance(pipe.stages[0], command.FunctionChain)
+        out, _err = pipe
+        self.assertEqual(out, "World!\n")
+        self.assertEqual([cmd.exit_code for cmd in pipe.commands], [0, 0, 0])
+
+
+class CommunicatingWorks(ShellTestCase):
+    """
+    Test collecting the output of commands
+    """
+
+    LOUD_STDERR = "import sys; sys.stderr.write('x' * 200000); print('done')"
+
+    def loud_stderr(self):
+        """
+        return a call to a subproc which fills its stderr pipe
+        """
+        return shell.CommandCall(
+            command.ProcessCommand(sys.executable, "-c", self.LOUD_STDERR))
+
+    def test_full_stderr_pipe(self):
+        """
+        test that a subproc filling its stderr pipe does not deadlock
+        """
+        out, err = self.loud_stderr()
+        self.assertEqual(out, "done\n")
+        self.assertEqual(len(err), 200000)
+
+    def test_limited_output(self):
+        """
+        test capping the output kept while still streaming all of it
+        """
+        chunks = []
+        out, err = self.loud_stderr().communicate(
+            limit=10, on_chunk=lambda name, chunk: chunks.append(chunk))
+        self.assertEqual(out, "done\n")
+        self.assertEqual(err, "x" * 10)
+        self.assertEqual(len("".join(chunks)), 200005)
+
+    def test_undecodable_output(self):
+        """
+        test that output which isn't UTF-8 raises once the subproc is done
+        instead of leaving it blocked on a full pipe
+        """
+        call = shell.CommandCall(
+            command.ProcessCommand(
+                sys.executable, "-c",
+                "import sys; sys.stderr.write('y' * 300000); "
+                "sys.stdout.buffer.write(b'\\xff' + b'x' * 300000)"))
+        with self.assertRaises(UnicodeDecodeError):
+            call.communicate()
+        self.assertEqual(call.wait(), 0)
+
+
+class StreamingWorks(ShellTestCase):
+    """
+    Test lazily reading the output of commands
+    """
+
+    def test_lines_of_function(self):
+        """
+        test reading the lines of a FunctionCommand
+        """
+        lines = self.shell.posix_echo("Hello\nWorld!").lines()
+        self.assertEqual(list(lines), ["Hello", "World!"])
+
+    def test_lines_of_pipe(self):
+        """
+        test reading the lines of a pipe ending in a subproc
+        """
+        pipe = self.shell.posix_echo("Hello\nWorld!") | self.shell.grep("W")
+        self.assertEqual(list(pipe.lines()), ["World!"])
+
+    def test_stop_reading_early(self):
+        """
+        test that closing the generator stops the command
+        """
+
+        def yes():
+            while True:
+                yield "y"
+
+        yes_cmd = shell.CommandCall(command.FunctionCommand(yes))
+        lines = yes_cmd.lines()
+        self.assertEqual(next(lines), "y")
+        lines.close()
+        self.assertEqual(yes_cmd.command.exit_code, -signal.SIGPIPE)
+
+
+class MappingWorks(ShellTestCase):
+    """
+    Test running a command over many arguments concurrently
+    """
+
+    def test_outputs_collected(self):
+        """
+        test that every call's output is collected
+        """
+        mapping = self.shell.map(self.shell.echo, ["a", "b", "c"])
+        outputs = sorted(out for _arg, _code, out, _err in mapping)
+        self.assertEqual(outputs, ["a\n", "b\n", "c\n"])
+        self.assertEqual(mapping.wait(), 0)
+
+    def test_calls_run_concurrently(self):
+        """
+        test that up to max_workers calls run at the same time
+        """
+        barrier = threading.Barrier(3, timeout=5)
+
+        def meet(name):
+            barrier.wait()
+            yield name
+
+        def factory(name):
+            return shell.CommandCall(command.FunctionCommand(meet, name))
+
+        mapping = self.shell.map(factory, ["a", "b", "c"], max_workers=3)
+        self.assertEqual(mapping.wait(), 0)
+
+    def test_failure_aggregated(self):
+        """
+        test that a failing call makes the whole mapping fail
+        """
+        mapping = self.shell.map(self.shell.ls,
+                                 ["example_file.txt", "missing_file.txt"])
+        self.assertNotEqual(mapping.wait(), 0)
+
+
+class CommandTableWorks(ShellTestCase):
+    """
+    Test caching the resolution of command names
+    """
+
+    def test_lookups_cached(self):
+        """
+        test that repeated lookups are served from the table
+        """
+        table = self.shell.command_table
+        self.assertIs(table.lookup("posix_grep"), table.lookup("posix_grep"))
+        self.assertIs(table.lookup("cat"), table.lookup("cat"))
+        self.assertEqual(table.stats(),
+                         {'commands': 2, 'hits': 2, 'misses': 2})
+
+    def test_path_change_invalidates(self):
+        """
+        test that executables are looked up again when $PATH changes
+        """
+        table = shell.CommandTable([], check_interval=0)
+        with tempfile.TemporaryDirectory() as bin_dir:
+            script = os.path.join(bin_dir, "cat")
+            with open(script, 'w') as script_file:
+                script_file.write("#!/bin/sh\necho fake\n")
+            os.chmod(script, 0o755)
+            old_path = os.environ["PATH"]
+            table.lookup("cat")
+            os.environ["PATH"] = bin_dir + os.pathsep + old_path
+            try:
+                out, _err = shell.CommandCall(table.lookup("cat")())
+            finally:
+                os.environ["PATH"] = old_path
+        self.assertEqual(out, "fake\n")
+        self.assertEqual(table.misses, 2)
+
+
+class FileShellTestCase(ShellTestCase):
+    """
+    Abstract base class for a shell test case working in a temporary
+    directory holding in.txt
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.shell.cd(self.tmp_dir.name)
+        with open(os.path.join(self.tmp_dir.name, "in.txt"), 'w') as in_file:
+            in_file.write("Hello\nWorld!\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        super().tearDown()
+
+    def read(self, name):
+        """
+        return the contents of a file in the temporary directory
+        """
+        with open(os.path.join(self.tmp_dir.name, name)) as tmp_file:
+            return tmp_file.read()
+
+
+class RedirectingWorks(FileShellTestCase):
+    """
+    Test redirecting the channels of calls to and from files
+    """
+
+    def test_write_and_append(self):
+        """
+        test truncating and appending to files with > and >>
+        """
+        (self.shell.posix_echo("first") > "out.txt")()
+        (self.shell.posix_echo("second") > "out.txt")()
+        (self.shell.echo("third") >> "out.txt")()
+        self.assertEqual(self.read("out.txt"), "second\nthird\n")
+
+    def test_fused_functions_write_in_shell_dir(self):
+        """
+        test that relative paths are in the shell's directory after a pipe
+        of functions
+        """
+        ((self.shell.posix_echo("Hello\nWorld!") | self.shell.posix_grep("W"))
+         > "out.txt")()
+        self.assertEqual(self.read("out.txt"), "World!\n")
+
+    def test_communicate_redirected(self):
+        """
+        test that redirected channels are left out of the output
+        """
+        out, err = self.shell.posix_echo("Hi") > "out.txt"
+        self.assertEqual((out, err), ("", ""))
+        self.assertEqual(self.read("out.txt"), "Hi\n")
+        out, err = self.shell.sh("-c", "echo out; echo err >&2").redirect(
+            stderr=shell.STDOUT)
+        self.assertEqual((out, err), ("out\nerr\n", ""))
+
+    def test_read_stdin(self):
+        """
+        test reading the stdin of functions and subprocs from a file
+        """
+        out, _err = self.shell.posix_grep("W") < "in.txt"
+        self.assertEqual(out, "World!\n")
+        out, _err = self.shell.wc("-l") < "in.txt"
+        self.assertEqual(int(out), 2)
+
+    def test_cat_files(self):
+        """
+        test posix.cat copying files to a file and into a pipe
+        """
+        ((self.shell.posix_cat("in.txt", "in.txt") | self.shell.posix_cat())
+         > "out.txt")()
+        self.assertEqual(self.read("out.txt"), "Hello\nWorld!\n" * 2)
+
+    def test_stderr_to_stdout(self):
+        """
+        test sending the stderr of functions and subprocs to stdout
+        """
+
+        @command.FunctionCommand.from_generator
+        def loud():
+            """
+            write to stdout and stderr
+            """
+            yield "out"
+            yield "stderr", "err"
+
+        (self.shell.sh("-c", "echo out; echo err >&2").redirect(
+            stdout="process.txt", stderr=shell.STDOUT))()
+        function_path = os.path.join(self.tmp_dir.name, "function.txt")
+        (shell.CommandCall(loud()).redirect(
+            stdout=function_path, stderr=shell.STDOUT))()
+        self.assertEqual(self.read("process.txt"), "out\nerr\n")
+        self.assertEqual(sorted(self.read("function.txt").split()),
+                         ["err", "out"])
+
+
+class TeeingWorks(FileShellTestCase):
+    """
+    Test copying the output of a call to several branches
+    """
+
+    def test_branches_get_stream(self):
+        """
+        test that function, subproc and file branches all get the output
+        """
+        call = self.shell.posix_cat("in.txt").tee(
+            self.shell.posix_grep("W") > "function.txt",
+            self.shell.wc("-l") > "process.txt",
+            "file.txt") | self.shell.posix_grep("H")
+        out, _err = call
+        self.assertEqual(out, "Hello\n")
+        self.assertEqual(self.read("function.txt"), "World!\n")
+        self.assertEqual(int(self.read("process.txt")), 2)
+        self.assertEqual(self.read("file.txt"), "Hello\nWorld!\n")
+
+    def test_branch_stops_early(self):
+        """
+        test that a branch which stops reading doesn't hold back the others
+        """
+        lines = ["line {}".format(index) for index in range(100000)]
+        call = self.shell.posix_echo("\n".join(lines)).tee(
+            self.shell.posix_head(1) > "head.txt",
+            self.shell.head("-n", "1") > "process.txt") | self.shell.wc("-l")
+        out, _err = call
+        self.assertEqual(int(out), len(lines))
+        self.assertEqual(self.read("head.txt"), "line 0\n")
+        self.assertEqual(self.read("process.txt"), "line 0\n")
+
+    def test_shared_buffer_bounded(self):
+        """
+        test that the writer of a SharedBuffer waits for its slowest reader
+        """
+        shared = stream.SharedBuffer(capacity=2)
+        fast, slow = shared.reader(), shared.reader()
+        writer = threading.Thread(
+            target=lambda: [shared.write(b"x") for _ in range(4)])
+        writer.start()
+        self.assertEqual(fast.read(2), b"x")
+        self.assertEqual(fast.read(2), b"x")
+        writer.join(0.1)
+        self.assertTrue(writer.is_alive())
+        self.assertEqual(len(shared.chunks), 2)
+        slow.close()
+        self.assertEqual(fast.read(2), b"x")
+        self.assertEqual(fast.read(2), b"x")
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        shared.close()
+        self.assertEqual(fast.read(), b"")
+
+
+class ProfilingWorks(ShellTestCase):
+    """
+    Test profiling the stages of a call
+    """
+
+    def test_stages_profiled(self):
+        """
+        test that processes and functions in a pipe are profiled
+        """
+        call = (self.shell.cat("example_file.txt") | self.shell.posix_grep(
+            "o") | self.shell.wc("-l")).profiled()
+        out, _err = call
+        report = call.profile.report()
+        cat, grep, wc = report['stages']
+        self.assertEqual([cat['kind'], grep['kind'], wc['kind']],
+                         ['process', 'function', 'process'])
+        self.assertEqual(grep['lines_out'], int(out))
+        self.assertGreater(grep['lines_in'], grep['lines_out'])
+        self.assertEqual(grep['bytes_in'], os.path.getsize(
+            os.path.join(os.path.dirname(__file__), "example_file.txt")))
+        for stage in report['stages']:
+            self.assertEqual(stage['exit_code'], 0)
+            self.assertIsNotNone(stage['cpu_user'])
+            self.assertLessEqual(stage['end'], report['wall'])
+
+
+class WorkingDirWorks(unittest.TestCase):
+    """
+    Test that commands run in their shell's working directory
+    """
+
+    def test_shells_in_parallel(self):
+        """
+        test that shells in different directories don't affect each other
+        """
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as first_dir, \
+                tempfile.TemporaryDirectory() as second_dir:
+            dirs = [os.path.realpath(first_dir), os.path.realpath(second_dir)]
+            shells = [shell.Shell(working_dir, '') for working_dir in dirs]
+            outputs = {}
+
+            def run_pwd(index):
+                for _ in range(20):
+                    out, _err = shells[index].pwd()
+                    outputs.setdefault(index, set()).add(out)
+
+            threads = [
+                threading.Thread(target=run_pwd, args=(index, ))
+                for index in range(2)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(outputs, {0: {dirs[0] + "\n"}, 1: {dirs[1] + "\n"}})
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_function_working_dir(self):
+        """
+        test that a function sees its shell's working directory
+        """
+
+        def pwd():
+            yield command.getcwd()
+
+        with tempfile.TemporaryDirectory() as working_dir:
+            pwd_call = shell.PartialCall(
+                command.FunctionCommand.from_generator(pwd), working_dir)
+            out, _err = pwd_call()
+        self.assertEqual(out, os.path.abspath(working_dir) + "\n")
+
+    def test_nested_shell_working_dir(self):
+        """
+        test that a relative working directory of a shell used inside a
+        function is relative to the function's
+        """
+
+        def nested_pwd():
+            out, _err = shell.Shell('.', '').pwd()
+            yield out.strip()
+
+        with tempfile.TemporaryDirectory() as working_dir:
+            pwd_call = shell.PartialCall(
+                command.FunctionCommand.from_generator(nested_pwd),
+                working_dir)
+            out, _err = pwd_call()
+        self.assertEqual(out, os.path.realpath(working_dir) + "\n")
+
+    def test_mapped_calls_working_dir(self):
+        """
+        test that calls mapped inside a function run in the function's
+        working directory
+        """
+
+        def mapped_pwd():
+            for _argument, _exit_code, out, _err in shell.Shell.map(
+                    lambda _argument: shell.Shell('.', '').pwd(), [1, 2]):
+                yield out.strip()
+
+        with tempfile.TemporaryDirectory() as working_dir:
+            pwd_call = shell.PartialCall(
+                command.FunctionCommand.from_generator(mapped_pwd),
+                working_dir)
+            out, _err = pwd_call()
+        self.assertEqual(out, (os.path.realpath(working_dir) + "\n") * 2)
@@ -0,0 +1,53 @@
+"""
+Test block-buffered reading and writing of channels
+"""
+
+import io
+import unittest
+
+from pysh.interface import stream
+
+
+class LineReaderWorks(unittest.TestCase):
+    """
+    Test splitting channels into batches of lines
+    """
+
+    def test_lines_split_across_chunks(self):
+        """
+        test that lines spanning several chunks are joined back together
+        """
+        reader = stream.LineReader(io.StringIO("Hello\nWorld!\n"), 4)
+        lines = []
+        batch = reader.readbatch()
+        while batch is not None:
+            lines.extend(batch)
+            batch = reader.readbatch()
+        self.assertEqual(lines, ["Hello", "World!"])
+
+    def test_unterminated_last_line(self):
+        """
+        test that a last line without a newline is still read
+        """
+        reader = stream.LineReader(io.BytesIO(b"Hello\nWorld!"))
+        self.assertEqual(reader.readbatch(), ["Hello"])
+        self.assertEqual(reader.readbatch(), ["World!"])
+        self.assertIsNone(reader.readbatch())
+
+
+class LineWriterWorks(unittest.TestCase):
+    """
+    Test batched writing of lines
+    """
+
+    def test_lines_buffered_until_flush(self):
+        """
+        test that lines are only written once flushed
+        """
+        channel = io.StringIO()
+        writer = stream.LineWriter(channel)
+        writer.write_lines(["Hello", "World!"])
+        self.assertEqual(channel.getvalue(), "")
+        writer.flush()
+        self.assertEqual(channel.getvalue(), "Hello\nWorld!\n")
+
@@ -0,0 +1,91 @@
+"""
+Test running graphs of tasks
+"""
+
+import io
+import os
+import tempfile
+import unittest
+
+from pysh.interface import command, task
+
+
+class TaskRunningWorks(unittest.TestCase):
+    """
+    Test running tasks along with their dependencies
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.runs = []
+        self.input_path = os.path.join(self.tmpdir.name, "input.txt")
+        with open(self.input_path, 'w') as input_file:
+            input_file.write("Hello\n")
+
+        @task.pyshtask(inputs=["input.txt"])
+        def configure():
+            self.runs.append("configure")
+
+        @task.pyshtask(depends=[configure], inputs=["input.txt"])
+        def compile_():
+            self.runs.append("compile")
+            with open(command.resolve_path("output.txt"), 'w') as output:
+                output.write("World!\n")
+
+        @task.pyshtask(depends=[configure, compile_])
+        def package():
+            self.runs.append("package")
+            return self.exit_code
+
+        self.exit_code = 0
+        self.package = package
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_tasks(self):
+        """
+        run the package task in the temporary directory
+        """
+        runner = task.TaskRunner(
+            state_path=os.path.join(self.tmpdir.name, "tasks.json"))
+        function_cmd = command.FunctionCommand(task.run_tasks,
+                                               [self.package], runner)
+        function_cmd.working_dir = self.tmpdir.name
+        stdout, stderr = io.StringIO(), io.StringIO()
+        exit_code = function_cmd(stdout=stdout, stderr=stderr)
+        return exit_code, stdout.getvalue(), stderr.getvalue()
+
+    def test_dependencies_run_first(self):
+        """
+        test that each task runs once, after its dependencies
+        """
+        exit_code, out, _err = self.run_tasks()
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(self.runs, ["configure", "compile", "package"])
+        self.assertIn(
+            "critical path: configure (", out.splitlines()[-1])
+
+    def test_unchanged_tasks_skipped(self):
+        """
+        test that tasks whose inputs are unchanged are skipped
+        """
+        self.run_tasks()
+        self.runs.clear()
+        _exit_code, out, _err = self.run_tasks()
+        self.assertEqual(self.runs, ["package"])
+        self.assertIn("compile_: skipped", out)
+        with open(self.input_path, 'a') as input_file:
+            input_file.write("World!\n")
+        self.runs.clear()
+        self.run_tasks()
+        self.assertEqual(self.runs, ["configure", "compile", "package"])
+
+    def test_failure_reported(self):
+        """
+        test that a failing task fails the run
+        """
+        self.exit_code = 2
+        exit_code, _out, err = self.run_tasks()
+        self.assertEqual(exit_code, 1)
+        self.assertIn("package: failed", err)
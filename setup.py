@@ -7,6 +7,6 @@ setup(name='pysh',
       author_email='rdabrams@gmail.com',
       url='https://github.com/caervs/pysh',
       packages=['pysh', 'pysh.interface', 'pysh.examples', 'pysh.scopes',
-                'pysh.scopes.standard', 'pysh.tests'],
+                'pysh.scopes.standard', 'pysh.tests', 'pysh.benchmarks'],
       package_data={'pysh.examples': ['*rc']},
       scripts=['scripts/pysh'], )